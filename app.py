@@ -1,24 +1,33 @@
 import ast
-from fastapi import FastAPI, HTTPException, Form, Depends, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Form, Depends, Header
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
-from sqlalchemy import Column, String, TIMESTAMP, create_engine, text, ForeignKey, Integer, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import Column, String, TIMESTAMP, text, ForeignKey, Integer, Boolean
+from sqlalchemy.orm import Session
+from database import Base, SessionLocal, DATABASE_URL, init_db
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart 
 from typing import List, Dict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+import hmac
+import math
+import threading
 import uuid
 from datetime import datetime, timedelta
 from email_verifier import find_valid_email
 from google_api import google_search
-from info_gather import get_company_and_person_info
-import requests
+import jobs
+from cancellation import JobCancelled, check_cancelled, set_stop_event
+from jobs import save_checkpoint, load_checkpoints
+from jobs import DISCOVERED, DM_FOUND, EMAIL_VERIFIED, DRAFTED, REJECTED
+from research_cache import get_company_and_person_info_cached, get_company_and_person_info_batch_cached, lookup_research, store_research_result
 import os
 import dns.resolver
 import json
-import re
 from fastapi.middleware.cors import CORSMiddleware
 from Crypto.Cipher import AES
 from base64 import b64decode
@@ -30,8 +39,16 @@ import random
 from passlib.context import CryptContext
 import jwt
 from typing import Optional
-from email_proposal import EmailProposalSystem
-import razorpay
+import metrics
+import progress
+from config import TEMPLATE_PDF_PATHS
+from json_stream import IncrementalJSONFields
+import llm_client
+from llm_client import post_chat_completion, LLMError
+from resilience import ServiceUnavailableError
+from structured_output import StructuredOutputError, parse_structured
+import usage_tracker
+from usage_tracker import usage_context, tag_usage
 import smtplib
 #import time module
 import time
@@ -43,18 +60,20 @@ import httpx
 # Load environment variables from .env file
 load_dotenv()
 
-# Database Configuration
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 secret_key = os.getenv('ENCRYPTION_KEY')
 
 # Razorpay setup
 RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET')
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+_razorpay_client = None
 
-Base = declarative_base()
+def get_razorpay_client():
+    # razorpay is only imported when a payment endpoint is first used
+    global _razorpay_client
+    if _razorpay_client is None:
+        import razorpay
+        _razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+    return _razorpay_client
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
@@ -63,11 +82,13 @@ ALGORITHM = "HS256"
 # Password hashing configuration
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-pdf_paths = {
-            "email": "email-template.pdf",
-            "followup": "followup-template.pdf",
-            "breakup": "breakup-template.pdf"
-        }
+pdf_paths = TEMPLATE_PDF_PATHS
+
+def get_email_proposal_system():
+    # Shared, application-scoped template retriever (built once at startup).
+    # Imported here so torch/faiss/PyPDF2 only load when proposals are first needed.
+    from email_proposal import get_proposal_system
+    return get_proposal_system(pdf_paths)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -199,13 +220,45 @@ class Subscription(Base):
     end_date = Column(TIMESTAMP, nullable=False)
     status = Column(String, default="Active")
 
-Base.metadata.create_all(bind=engine)
-
 # Email Configuration
 SMTP_SERVER = os.getenv('SMTP_SERVER')
 SMTP_PORT = os.getenv('SMTP_PORT')
 USERNAME = os.environ.get('EMAIL_USERNAME')
 PASSWORD = os.environ.get('EMAIL_PASSWORD')
+# Offline and load testing (see standins.py): deliver all mail to one SMTP
+# server ("host:port", plain text, no STARTTLS), resolve MX records through
+# DNS_NAMESERVER ("host:port") and build tracking links on TRACKING_BASE_URL.
+SMTP_OVERRIDE = os.getenv('SMTP_OVERRIDE')
+DNS_NAMESERVER = os.getenv('DNS_NAMESERVER')
+TRACKING_BASE_URL = os.getenv('TRACKING_BASE_URL', 'https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net').rstrip('/')
+
+
+def _host_port(address, default_port):
+    host, _, port = address.partition(':')
+    return host, int(port or default_port)
+
+
+mx_resolver = dns.resolver  # the system resolver unless DNS_NAMESERVER is set
+if DNS_NAMESERVER:
+    mx_resolver = dns.resolver.Resolver(configure=False)
+    nameserver, mx_resolver.port = _host_port(DNS_NAMESERVER, 53)
+    mx_resolver.nameservers = [nameserver]
+
+
+@contextmanager
+def smtp_connection(smtp_server, smtp_port, username, password):
+    """Logged-in SMTP connection (STARTTLS), or a plain one to SMTP_OVERRIDE when set"""
+    if SMTP_OVERRIDE:
+        with smtplib.SMTP(*_host_port(SMTP_OVERRIDE, 25)) as server:
+            server.login(username, password)
+            yield server
+        return
+    with smtplib.SMTP(smtp_server, smtp_port) as server:
+        server.ehlo()
+        server.starttls()
+        server.ehlo()
+        server.login(username, password)
+        yield server
 
 
 # FastAPI app
@@ -225,6 +278,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Upstream failures that survive retries surface as 502/503 instead of crashing the handler
+@app.exception_handler(LLMError)
+async def llm_error_handler(request, exc: LLMError):
+    return JSONResponse(status_code=502, content={"detail": f"LLM request failed: {exc}"})
+
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(request, exc: ServiceUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
 # Pydantic Models
 class EmailData(BaseModel):
     recipient_name: str
@@ -351,7 +413,30 @@ class PaymentFailure(BaseModel):
 
 # OpenAI and Perplexity Configuration
 API_KEY = os.getenv("PERPLEXITY_API_KEY")
-BASE_URL = "https://api.perplexity.ai/chat/completions"
+
+# Companies worked on at once in each phase of a discovery run
+DISCOVERY_CONCURRENCY = int(os.getenv("DISCOVERY_CONCURRENCY", 5))
+# Candidate companies requested per company still needed. The surplus covers
+# companies whose decision maker cannot be verified, so a run rarely needs a
+# second discovery round; work on the spare candidates is cancelled once enough
+# decision makers are found.
+DISCOVERY_SURPLUS_FACTOR = float(os.getenv("DISCOVERY_SURPLUS_FACTOR", 2.0))
+
+# Research and draft each proposal in one LLM request instead of two
+PROPOSAL_SINGLE_PASS = os.getenv("PROPOSAL_SINGLE_PASS", "0") == "1"
+
+# Token required by the /admin endpoints (they are disabled when unset)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# asyncpg pool shared by the async endpoints, and the LISTEN connection's reconnect delay
+ASYNCPG_POOL_MIN_SIZE = int(os.getenv("ASYNCPG_POOL_MIN_SIZE", 1))
+ASYNCPG_POOL_MAX_SIZE = int(os.getenv("ASYNCPG_POOL_MAX_SIZE", 10))
+LISTEN_RETRY_SECONDS = float(os.getenv("LISTEN_RETRY_SECONDS", 5))
+# Run discovery job workers (job_worker.py) inside the app process; set to 0
+# when they are deployed as separate `python job_worker.py` processes
+RUN_JOB_WORKERS = os.getenv("RUN_JOB_WORKERS", "1") == "1"
+# Seconds between keepalive comments on an idle /progress/stream
+PROGRESS_KEEPALIVE_SECONDS = float(os.getenv("PROGRESS_KEEPALIVE_SECONDS", 15))
 
 def get_db():
     db = SessionLocal()
@@ -397,7 +482,7 @@ def identify_smtp_server(email: str) -> tuple:
     
     # Attempt to retrieve the MX records for the domain.
     try:
-        mx_records = dns.resolver.resolve(domain, 'MX')
+        mx_records = mx_resolver.resolve(domain, 'MX')
     except Exception as e:
         raise HTTPException(
             status_code=400, 
@@ -516,9 +601,7 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     msg.attach(MIMEText(body, 'html'))
 
     try:
-        with smtplib.SMTP(os.getenv('SMTP_SERVER'), os.getenv('SMTP_PORT')) as server:
-            server.starttls()
-            server.login(os.getenv('EMAIL_USERNAME'), os.getenv('EMAIL_PASSWORD'))
+        with smtp_connection(os.getenv('SMTP_SERVER'), os.getenv('SMTP_PORT'), os.getenv('EMAIL_USERNAME'), os.getenv('EMAIL_PASSWORD')) as server:
             server.sendmail(os.getenv('EMAIL_USERNAME'), user.email, msg.as_string())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending email: {e}")
@@ -573,32 +656,54 @@ def get_user(user_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error fetching user: {e}")
 
 @app.post("/potential-companies")
-async def start_process(background_tasks: BackgroundTasks, request: ProductRequest, db: Session = Depends(get_db)):
-    background_tasks.add_task(get_generated_companies(request))
-    return {"message": "Companies generation process started"}
-def get_potential_companies(request: ProductRequest, db: Session = Depends(get_db)):
-    try:
-        if not API_KEY:
-            raise HTTPException(status_code=500, detail="API Key not configured")
-        
-        existing_customers = request.existing_customers
-        print("Starting potential companies generation")
-        potential_dms = []
+def start_process(request: ProductRequest, db: Session = Depends(get_db)):
+    # The run happens on a job worker (in the app or a job_worker.py process); poll GET /jobs/{job_id} for its status
+    product_item = db.query(ProductDetails).filter(ProductDetails.product_id == request.product_id).first()
+    if not product_item:
+        raise HTTPException(status_code=404, detail="Product not found")
+    product_item.preloading_status = True
+    db.commit()
+    job_id = jobs.enqueue_job(request.user_id, request.product_id, request.model_dump(exclude_unset=True))
+    return {"message": "Companies generation process started", "job_id": job_id}
 
-        db = SessionLocal()
-        product_item = db.query(ProductDetails).filter(ProductDetails.product_id == request.product_id).first()
-        if not product_item:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        product_item.preloading_status = True
-        db.commit()
-        
-        while len(potential_dms) < request.limit:
+def fan_out(fn, items):
+    """Yield (item, result, error) for fn(item) as each call finishes, DISCOVERY_CONCURRENCY at a time.
+
+    Calls run in copies of the caller's context, so usage tags and job
+    cancellation carry over. Leaving the loop early cancels the calls not yet
+    started and stops running ones at their next check_cancelled().
+    """
+    stop = threading.Event()
+
+    def run(item):
+        set_stop_event(stop)
+        return fn(item)
+
+    executor = ThreadPoolExecutor(max_workers=DISCOVERY_CONCURRENCY, thread_name_prefix="discovery")
+    futures = {executor.submit(contextvars.copy_context().run, run, item): item for item in items}
+    try:
+        for future in as_completed(futures):
             try:
-                prompt = f"""
+                result, error = future.result(), None
+            except JobCancelled:
+                raise
+            except Exception as e:
+                result, error = None, e
+            yield futures[future], result, error
+    finally:
+        stop.set()
+        abandoned = sum(not future.done() for future in futures)
+        if abandoned:
+            metrics.incr("discovery_calls_abandoned", abandoned)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def discover_companies(request: ProductRequest, existing_customers: list, candidate_count: int):
+    """Ask the LLM for candidate companies matching the product's ICP; returns the validated company list"""
+    try:
+        prompt = f"""
     Given the detailed product information and Ideal Client Profile (ICP) provided below, analyze and identify:
-    1. The top {request.limit} companies that demonstrate a strong potential to become customers of {request.product_name}. Each identified company must strictly satisfy the specified target criteria—including employee count, industry, geographical location, and business model—and show clear indicators of being a viable future customer for this product. Exclude any companies listed in the 'Existing Customers' from this list.
-    2. Craft the output potential companies with the limit of {request.limit} that are defined as companies with a significant market presence, a long track record of success, and stable growth. These companies should also meet the target criteria for employee count, industry, geographical location, and business model.
+    1. The top {candidate_count} companies that demonstrate a strong potential to become customers of {request.product_name}. Each identified company must strictly satisfy the specified target criteria—including employee count, industry, geographical location, and business model—and show clear indicators of being a viable future customer for this product. Exclude any companies listed in the 'Existing Customers' from this list.
+    2. Craft the output potential companies with the limit of {candidate_count} that are defined as companies with a significant market presence, a long track record of success, and stable growth. These companies should also meet the target criteria for employee count, industry, geographical location, and business model.
 
     ### Product Information:
     - **Product Name**: {request.product_name} ( This is the name of the product )
@@ -629,73 +734,196 @@ def get_potential_companies(request: ProductRequest, db: Session = Depends(get_d
     Ensure that the output strictly adheres to this format and includes only companies that meet all specified criteria. If certain details cannot be verified, omit those companies from the list. Provide only the JSON as output without any additional text or content.
     """
 
-                payload = {
-                    "model": "sonar",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 300,
-                }
-                response = requests.post(
-                    BASE_URL,
-                    headers={"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"},
-                    json=payload,
-                )
-                response.raise_for_status()
-                data = response.json()
-                usage = data.get("usage", {})
-                print("Potential companies generated")
-                print(f"Input tokens: {usage.get('prompt_tokens', 'N/A') * 0.0000002}")
-                print(f"Output tokens: {usage.get('completion_tokens', 'N/A') * 0.0000002}")
-                print(f"Total tokens: {usage.get('total_tokens', 'N/A')}")
-            except requests.exceptions.RequestException as e:
-                raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
+        payload = {
+            "model": "sonar",
+            "messages": [{"role": "user", "content": prompt}],
+            # ~60 tokens per company, so the surplus list is not cut short
+            "max_tokens": max(300, 60 * candidate_count),
+        }
+        with usage_context(stage="discover_companies"):
+            data = post_chat_completion(payload)
+        print("Potential companies generated")
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
+
+    if not data or "choices" not in data or not data["choices"]:
+        raise HTTPException(status_code=500, detail="Invalid response from API")
+
+    return format_response(data, "company_list")
 
-            if not data or "choices" not in data or not data["choices"]:
-                raise HTTPException(status_code=500, detail="Invalid response from API")
+def research_candidates(candidates, product_description):
+    """Research for each candidate decision maker; None entries when drafts research for themselves (single pass)"""
+    if PROPOSAL_SINGLE_PASS:
+        # get_email_proposal reuses cached research or researches and drafts in one request
+        return [None] * len(candidates)
+    return get_company_and_person_info_batch_cached([
+        {"company_name": dm['name'], "person_name": dm['decision_maker_name'], "position": dm['decision_maker_position']}
+        for dm in candidates
+    ], product_description)
 
-            formatted_response = format_response(data)
+def get_potential_companies(request: ProductRequest, db: Session = Depends(get_db), job_id: str = None):
+    tag_usage(user_id=request.user_id, product_id=request.product_id)
+    try:
+        if not API_KEY:
+            raise HTTPException(status_code=500, detail="API Key not configured")
+        
+        existing_customers = request.existing_customers
+        print("Starting potential companies generation")
+        potential_dms = []
 
+        db = SessionLocal()
+        product_item = db.query(ProductDetails).filter(ProductDetails.product_id == request.product_id).first()
+        if not product_item:
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        product_item.preloading_status = True
+        db.commit()
+        
+        # Resuming a job: companies it already drafted count towards the limit, and the
+        # others continue from the stage they reached
+        pending = []
+        for checkpoint in load_checkpoints(job_id):
+            existing_customers.append(checkpoint['company_name'])
+            if checkpoint['stage'] == DRAFTED:
+                potential_dms.append(checkpoint['data'])
+            elif checkpoint['stage'] != REJECTED:
+                pending.append(checkpoint)
+        if pending or potential_dms:
+            print(f"Resuming {job_id}: {len(potential_dms)} drafted, {len(pending)} in progress")
+        if potential_dms:
+            # The DRAFTED checkpoint is written before the company is saved, so a crash in
+            # between leaves it unsaved; save those now (and never a company twice)
+            saved = {row.company_name for row in db.query(GeneratedCompany.company_name).filter(
+                GeneratedCompany.user_id == request.user_id, GeneratedCompany.product_id == request.product_id)}
+            unsaved = [potential_dm for potential_dm in potential_dms if potential_dm['name'] not in saved]
+            if unsaved:
+                add_generated_companies(GeneratedCompanyRequest(product_id=request.product_id, companies=unsaved), request.user_id)
+
+        while len(potential_dms) < request.limit:
+            check_cancelled()
+            needed = request.limit - len(potential_dms)
+            candidate_count = math.ceil(needed * DISCOVERY_SURPLUS_FACTOR)
+            if pending:
+                entries, pending = pending, []
+            else:
+                formatted_response = discover_companies(request, existing_customers, candidate_count)
+                entries = []
+                for company in formatted_response:
+                    existing_customers.append(company['name'])
+                    save_checkpoint(job_id, company['name'], DISCOVERED, company)
+                    entries.append({"company_name": company['name'], "stage": DISCOVERED, "data": company})
             print("Getting potential Decision Makers")
 
             i=0
 
-            for company in formatted_response:
-                comp_name = company['name']
-                industry = company['industry']
-                domain = company['domain']
-                existing_customers.append(comp_name)
-                print("Req", existing_customers)
-                ref_request = DecisionMakerRequest(company_name=comp_name, domain_name=domain, industry=industry)
-                potential_dm = get_potential_decision_makers(request=ref_request)
+            # Phase 1: find a decision maker with a verified email for each company, concurrently,
+            # until `needed` are found
+            entries_lock = threading.Lock()
+
+            def advance(entry, stage, data):
+                # Checkpoint the stage and keep the entry in step, so a company carried into
+                # the next round continues from here
+                save_checkpoint(job_id, entry['company_name'], stage, data)
+                with entries_lock:
+                    entry.update(stage=stage, data=data)
+
+            def verify_company(entry):
+                check_cancelled()
+                with entries_lock:
+                    stage, data = entry['stage'], entry['data']
+                if stage == EMAIL_VERIFIED:
+                    return data
+                company = data if stage == DISCOVERED else data['company']
+                ref_request = DecisionMakerRequest(company_name=company['name'], domain_name=company['domain'], industry=company['industry'])
+                if stage == DISCOVERED:
+                    dm_map = identify_decision_makers(ref_request)
+                    advance(entry, DM_FOUND, {"company": company, "dm_map": dm_map})
+                else:
+                    dm_map = data['dm_map']
+                potential_dm = verify_decision_makers(ref_request, dm_map)
                 if potential_dm['decision_maker_email']:
                     potential_dm['status'] = "Decision Maker Found"
-                    curr_user = db.query(User).filter(User.id == request.user_id).first()
-                    email_proposal_req = EmailProposalRequest(
-                        product_description=request.product_description,
-                        company_name=comp_name,
-                        decision_maker=potential_dm['decision_maker_name'],
-                        decision_maker_position=potential_dm['decision_maker_position'],
-                        sender_name=curr_user.first_name + ' ' + curr_user.last_name,
-                        sender_position=request.sender_position,
-                        sender_company=request.sender_company
-                    )
-                    generated_proposal = get_email_proposal(email_proposal_req)
-                    print(f"{i} Generated Proposal: ", generated_proposal)
-                    i+=1
-                    potential_dm['status'] = "Mail Drafted"
-                    potential_dm['personality_type'] = generated_proposal['personality_type']
-                    potential_dm['subject'] = generated_proposal['subject']
-                    potential_dm['body'] = generated_proposal['body']
-                    potential_dms.append(potential_dm)
-                    if len(potential_dms) == request.limit:
-                        print("Potential companies fetched and formatted: ", potential_dms)
+                    advance(entry, EMAIL_VERIFIED, potential_dm)
+                else:
+                    advance(entry, REJECTED, potential_dm)
+                return potential_dm
+
+            candidates = []
+            errors = []
+            finished = set()
+            for entry, potential_dm, error in fan_out(verify_company, entries):
+                finished.add(entry['company_name'])
+                if error:
+                    print(f"Decision maker search failed for {entry['company_name']}: {error}")
+                    errors.append(error)
+                    continue
+                if potential_dm['decision_maker_email']:
+                    candidates.append(potential_dm)
+                    if len(candidates) == needed:
                         break
+            # Surplus companies abandoned mid-search are picked up again by the next round,
+            # from the stage they reached
+            with entries_lock:
+                pending = [dict(entry) for entry in entries if entry['company_name'] not in finished and entry['stage'] != REJECTED]
+
+            # Phase 2: research all of them in as few LLM requests as possible
+            researches = research_candidates(candidates, request.product_description)
+
+            # Phase 3: draft an email for each one from its research, concurrently. Every draft
+            # uses the same retrieval query, so the template is looked up once for the batch
+            curr_user = db.query(User).filter(User.id == request.user_id).first()
+            template = None
+            if candidates:
+                proposal_system = get_email_proposal_system()
+                if proposal_system.indexes:
+                    matches = proposal_system.retrieve_best_templates([EMAIL_PROPOSAL_QUERY], 1, "email")[0]
+                    template = matches[0][0] if matches else None
+
+            def draft_proposal(candidate):
+                check_cancelled()
+                potential_dm, research = candidate
+                if research is not None and "error" in research:
+                    # Research failed for this company only; it stays at EMAIL_VERIFIED for a retry
+                    raise LLMError(research["error"])
+                email_proposal_req = EmailProposalRequest(
+                    product_description=request.product_description,
+                    company_name=potential_dm['name'],
+                    decision_maker=potential_dm['decision_maker_name'],
+                    decision_maker_position=potential_dm['decision_maker_position'],
+                    sender_name=curr_user.first_name + ' ' + curr_user.last_name,
+                    sender_position=request.sender_position,
+                    sender_company=request.sender_company
+                )
+                return get_email_proposal(email_proposal_req, research=research, template=template)
+
+            drafted = 0
+            for (potential_dm, _), generated_proposal, error in fan_out(draft_proposal, list(zip(candidates, researches))):
+                if error:
+                    print(f"Drafting failed for {potential_dm['name']}: {error}")
+                    errors.append(error)
+                    continue
+                print(f"{i} Generated Proposal: ", generated_proposal)
+                i+=1
+                drafted += 1
+                potential_dm['status'] = "Mail Drafted"
+                potential_dm['personality_type'] = generated_proposal['personality_type']
+                potential_dm['subject'] = generated_proposal['subject']
+                potential_dm['body'] = generated_proposal['body']
+                # Saved as soon as it is drafted, so a crash later in the run loses nothing;
+                # checkpointed first, so a resumed job can tell whether the save happened
+                save_checkpoint(job_id, potential_dm['name'], DRAFTED, potential_dm)
+                add_generated_companies(GeneratedCompanyRequest(product_id=request.product_id, companies=[potential_dm]), request.user_id)
+                potential_dms.append(potential_dm)
+                if len(potential_dms) == request.limit:
+                    print("Potential companies fetched and formatted: ", potential_dms)
+                    break
+
+            # Every company in the round failed: retrying would just fail the same way
+            if not drafted and errors:
+                raise errors[0]
 
         print("Potential companies fetched and formatted: ", potential_dms)
 
-        req = GeneratedCompanyRequest(product_id=request.product_id, companies=potential_dms)
-
-        add_generated_company = add_generated_companies(req, request.user_id)
-
         # send a notification message telling the user that the companies have been generated
         db = SessionLocal()
         user_mail = db.query(User).filter(User.id == request.user_id).first().email
@@ -782,6 +1010,13 @@ def get_potential_companies(request: ProductRequest, db: Session = Depends(get_d
     
         return potential_dms
     
+    except JobCancelled:
+        db = SessionLocal()
+        product_item = db.query(ProductDetails).filter(ProductDetails.product_id == request.product_id).first()
+        product_item.preloading_status = False
+        db.commit()
+        raise
+
     except Exception as e:
         db = SessionLocal()
         user_mail = db.query(User).filter(User.id == request.user_id).first().email
@@ -859,6 +1094,10 @@ def get_potential_companies(request: ProductRequest, db: Session = Depends(get_d
 
 # @app.post("/potential-decision-makers")
 def get_potential_decision_makers(request: DecisionMakerRequest):
+    return verify_decision_makers(request, identify_decision_makers(request))
+
+def identify_decision_makers(request: DecisionMakerRequest):
+    """Search for the company's leaders and let the LLM pick the decision maker; returns the dm_map"""
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API Key not configured")
     
@@ -870,6 +1109,7 @@ def get_potential_decision_makers(request: DecisionMakerRequest):
 
     query = f"{request.company_name} {request.industry}"
     print("QUERY: ", query)
+    check_cancelled()
     result = google_search(query, limit=3)
     # result = google_search(api_key, domain_search_engine_id, query, limit=3)
     # domain_docs = [item.get('link').split('//')[-1].split('/')[0].replace('www.', '') for item in result.get('items', [])]
@@ -886,6 +1126,7 @@ def get_potential_decision_makers(request: DecisionMakerRequest):
     results = []
     for i in positions:
         query = f"Current {i} at {domain} site:linkedin.com"
+        check_cancelled()
         result = google_search(query, limit=3)
         # result = google_search(api_key, search_engine_id, query, limit=3)  # Set limit to 5
         # Process results
@@ -945,26 +1186,22 @@ def get_potential_decision_makers(request: DecisionMakerRequest):
     }
 
 
+    check_cancelled()
     try:
-        response = requests.post(
-            BASE_URL,
-            headers={"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"},
-            json=payload,
-        )
-        data = response.json()
-        usage = data.get("usage", {})
-        print(f"Input tokens: {usage.get('prompt_tokens', 'N/A') * 0.000005}")
-        print(f"Output tokens: {usage.get('completion_tokens', 'N/A') * 0.000008}")
-        print(f"Total tokens: {usage.get('total_tokens', 'N/A')}")
-        response.raise_for_status()
+        with usage_context(stage="find_decision_maker"):
+            data = post_chat_completion(payload)
     
-    except requests.exceptions.RequestException as e:
+    except LLMError as e:
         raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
     
-    api_response = format_response(response.json())
+    api_response = format_response(data, "dm_map")
 
     print("Decision makers found and formatted for ", comp_name)
+    return api_response
 
+def verify_decision_makers(request: DecisionMakerRequest, api_response: dict):
+    """Find a deliverable email and LinkedIn URL for the decision makers in a dm_map"""
+    comp_name = request.company_name
     company = {'name': comp_name, 'decision_maker_name': None, 'decision_maker_email': None, 'decision_maker_position': None, 'linkedin_url': None, 'domain': api_response['domain'], 'industry': request.industry}
 
     dm_names = []
@@ -988,6 +1225,7 @@ def get_potential_decision_makers(request: DecisionMakerRequest):
             elif len(key.split(' ')) == 1:
                 first_name = key
 
+            check_cancelled()
             ref = find_valid_email(first_name, last_name, company['domain'])
             # print(ref)
             valid_email, status = ref
@@ -1026,49 +1264,173 @@ def get_potential_decision_makers(request: DecisionMakerRequest):
     return company
 
 
+# Shared asyncpg pool for the async endpoints, created on startup (None when
+# DATABASE_URL is not PostgreSQL)
+db_pool = None
+# Set on shutdown to stop the in-process job workers claiming new jobs
+job_workers_stopping = threading.Event()
+
 @app.get("/product_loading_status")
 async def get_product_loading_status(user_id: str, product_id: str, db: Session = Depends(get_db)):
+    if db_pool is None:
+        raise HTTPException(status_code=503, detail="Database pool not available")
     try:
-        conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
-        row = await conn.fetchrow("SELECT preloading_status FROM product_details WHERE product_id = $1", product_id)
-        await conn.close()
-        if row:
-            return {"product_id": product_id, "preloading_status": row["preloading_status"]}
-        else:
-            raise HTTPException(status_code=404, detail="Product not found")
+        row = await db_pool.fetchrow("SELECT preloading_status FROM product_details WHERE product_id = $1", product_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if row:
+        return {"product_id": product_id, "preloading_status": row["preloading_status"]}
+    else:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+@app.get("/progress/stream")
+async def stream_progress(user_id: str = None, product_id: str = None):
+    # Server-sent events for the discovery jobs of one product (or all of a user's):
+    # queued, started, company_found, dm_found, dm_verified, company_rejected,
+    # draft_ready, then done / failed / cancelled, plus "status" when a product's
+    # preloading_status changes. Replaces polling /product_loading_status and /jobs/{job_id}.
+    if not user_id and not product_id:
+        raise HTTPException(status_code=400, detail="user_id or product_id is required")
+
+    async def events():
+        queue = progress.broker.subscribe(user_id=user_id, product_id=product_id)
+        try:
+            if product_id and db_pool is not None:
+                row = await db_pool.fetchrow("SELECT preloading_status FROM product_details WHERE product_id = $1", product_id)
+                if row:
+                    yield sse_event("status", {"product_id": product_id, "preloading_status": row["preloading_status"]})
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # A comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(message.get("event", "progress"), {key: value for key, value in message.items() if key != "event"})
+        finally:
+            progress.broker.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Callback function called when a notification is received from PostgreSQL.
 def notify_callback(connection, pid, channel, payload):
     try:
         # Parse the JSON payload from PostgreSQL
         data = json.loads(payload)
-        product_id = data.get("product_id")
-        preloading_status = data.get("preloading_status")
-        # Schedule the sending of notifications as an asyncio task.
+        if channel == progress.PROGRESS_CHANNEL:
+            progress.broker.dispatch(data)
+        else:
+            progress.broker.dispatch({
+                "event": "status",
+                "user_id": data.get("user_id"),
+                "product_id": data.get("product_id"),
+                "preloading_status": data.get("preloading_status"),
+            })
     except Exception as e:
         print("Error parsing payload:", e)
 
-# Background task that connects to PostgreSQL and listens for notifications.
+# Background task holding the app's one LISTEN connection; reconnects if it drops.
 async def listen_to_db():
-    try:
-        conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
-        # Listen on the "preloading_status_change" channel
-        await conn.add_listener('preloading_status_change', notify_callback)
-        # Keep the task running indefinitely.
-        while True:
-            await asyncio.sleep(1)
-    except Exception as e:
-        print("Error in listen_to_db:", e)
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+            await conn.add_listener('preloading_status_change', notify_callback)
+            await conn.add_listener(progress.PROGRESS_CHANNEL, notify_callback)
+            while not conn.is_closed():
+                await asyncio.sleep(1)
+            print("listen_to_db: connection lost, reconnecting")
+        except Exception as e:
+            print("Error in listen_to_db:", e)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
 
-# Startup event: launch the background listener.
+# Startup event: build the shared proposal system, start the async LLM client and the in-process job workers, open the asyncpg pool and launch the background listener.
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(listen_to_db())
+    global db_pool
+    init_db()
+    get_email_proposal_system().start_watching()
+    await llm_client.astart()
+    if RUN_JOB_WORKERS:
+        # Daemon threads: a job cut off by a restart is requeued when its lease expires
+        import job_worker
+        job_worker.start_workers(job_workers_stopping, daemon=True)
+    if DATABASE_URL and DATABASE_URL.startswith("postgres"):
+        try:
+            db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=ASYNCPG_POOL_MIN_SIZE, max_size=ASYNCPG_POOL_MAX_SIZE)
+        except Exception as e:
+            print("Could not create the asyncpg pool:", e)
+        asyncio.create_task(listen_to_db())
+    else:
+        print("DATABASE_URL is not PostgreSQL: no asyncpg pool or LISTEN/NOTIFY progress events")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_workers_stopping.set()
+    llm_client.close()
+    await llm_client.aclose()
+    usage_tracker.flush()
+    if db_pool is not None:
+        await db_pool.close()
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, db: Session = Depends(get_db)):
+    job = jobs.request_cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == jobs.CANCELLED:
+        # Cancelled before a worker picked it up, so nothing else will clear the loading flag
+        product_item = db.query(ProductDetails).filter(ProductDetails.product_id == job["product_id"]).first()
+        if product_item:
+            product_item.preloading_status = False
+            db.commit()
+    return job
+
+@app.post("/jobs/{job_id}/resume")
+def resume_job(job_id: str, db: Session = Depends(get_db)):
+    job = jobs.resume_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == jobs.QUEUED:
+        product_item = db.query(ProductDetails).filter(ProductDetails.product_id == job["product_id"]).first()
+        if product_item:
+            product_item.preloading_status = True
+            db.commit()
+    return job
+
+@app.get("/usage")
+def get_usage(user_id: str, product_id: Optional[str] = None, days: int = 30, db: Session = Depends(get_db)):
+    # LLM tokens, cost and latency per product, per day and per pipeline stage
+    usage_tracker.flush()
+    return usage_tracker.aggregate(db, user_id, product_id, days)
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+@app.post("/admin/reload-templates")
+def reload_templates(x_admin_token: Optional[str] = Header(None), proposal_system = Depends(get_email_proposal_system)):
+    if not ADMIN_TOKEN or not hmac.compare_digest((x_admin_token or "").encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Not authorised")
+    return proposal_system.reload_templates()
+
+EMAIL_PROPOSAL_QUERY = "Personalised Email proposal based on Target Company and Decision Maker"
 
 # @app.post("/email-proposal")
-def get_email_proposal(request: EmailProposalRequest):
+def get_email_proposal(request: EmailProposalRequest, proposal_system=None, research=None, template=None):
+    # `research` is a research response fetched beforehand (e.g. by a batched
+    # research call); when given, only the draft request is made. `template` is
+    # likewise a template already retrieved for a whole batch of drafts.
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API Key not configured")
     
@@ -1084,19 +1446,12 @@ def get_email_proposal(request: EmailProposalRequest):
         dm_pos = request.decision_maker_position
         # domain = decision_maker['domain']
 
-        response = get_company_and_person_info(request.decision_maker, ref_dm, dm_pos, request.product_description)
-
-        print("Information fetched for ", ref_dm," from the company ", company_name,":", response)
-
-        req_info = format_response(response)
-
-        print("Information fetched for ", ref_dm)
-
-        query = "Personalised Email proposal based on Target Company and Decision Maker"
+        query = EMAIL_PROPOSAL_QUERY
 
         situation = "email"
         
-        proposal_system = EmailProposalSystem(pdf_paths)
+        if proposal_system is None:
+            proposal_system = get_email_proposal_system()
         
         # Mock request data
         mock_request = {
@@ -1105,12 +1460,28 @@ def get_email_proposal(request: EmailProposalRequest):
             "sender_position": request.sender_position,
             "sender_company": request.sender_company
         }
-        
+
+        if research is not None:
+            response = research
+        elif PROPOSAL_SINGLE_PASS:
+            response = lookup_research(company_name, ref_dm, dm_pos, request.product_description)
+            if response is None:
+                # No cached research: research and draft in one round trip
+                return get_email_proposal_single_pass(proposal_system, query, situation, company_name, ref_dm, dm_pos, mock_request, template)
+        else:
+            response = get_company_and_person_info_cached(company_name, ref_dm, dm_pos, request.product_description)
+
+        print("Information fetched for ", ref_dm," from the company ", company_name,":", response)
+
+        req_info = format_response(response, "research")
+
+        print("Information fetched for ", ref_dm)
         
         # Generate email
         response = proposal_system.generate_email(
             query=query,
             situation=situation,
+            template=template,
             company_name=company_name,
             decision_maker=ref_dm,
             decision_maker_position=dm_pos,
@@ -1120,10 +1491,10 @@ def get_email_proposal(request: EmailProposalRequest):
 
         response, decision_maker_context = response
         
-        # print the generated email
-        print(format_response(response))
+        response = format_response(response, "draft")
 
-        response = format_response(response)
+        # print the generated email
+        print(response)
 
         print("Email template generated for", ref_dm)
 
@@ -1131,44 +1502,88 @@ def get_email_proposal(request: EmailProposalRequest):
 
         return response
 
-def format_response(response):
-    # Get the raw content from the API response.
-    json_string = response["choices"][0]["message"]["content"].strip()
-    
-    # First, try to extract JSON content between ```json and ```
-    match = re.search(r'```json\s*(.*?)\s*```', json_string, re.DOTALL)
-    if match:
-        candidate = match.group(1).strip()
-    else:
-        # If no code block markers, use the full response
-        candidate = json_string
+def get_email_proposal_single_pass(proposal_system, query, situation, company_name, decision_maker, decision_maker_position, mock_request, template=None):
+    response = proposal_system.generate_email_single_pass(
+        query=query,
+        situation=situation,
+        template=template,
+        company_name=company_name,
+        decision_maker=decision_maker,
+        decision_maker_position=decision_maker_position,
+        **mock_request
+    )
+    result = format_response(response, "single_pass")
+    research = result['research']
+    email = result['email']
+
+    # Reminders and followups for this decision maker can reuse the research
+    store_research_result(company_name, decision_maker, decision_maker_position, mock_request['product_description'], research)
+
+    print("Email template generated for", decision_maker, "(single pass)")
+
+    email['personality_type'] = research.get('decision_maker_profile', {}).get('personality_type', '')
+    return email
 
-    # Remove single-line comments (// ...) from the candidate.
-    # This uses MULTILINE mode so that any line that starts with // (or has them after some whitespace) is removed.
-    candidate = re.sub(r'(?m)^\s*//.*$', '', candidate)
-    # Also remove inline comments that start with // and continue until the end of the line.
-    candidate = re.sub(r'(?m)([^:])//.*$', r'\1', candidate)
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # Optionally, remove trailing commas (if any) before closing brackets/braces.
-    candidate = re.sub(r',\s*([}\]])', r'\1', candidate)
+@app.post("/email-proposal/stream")
+async def stream_email_proposal(request: EmailProposalRequest, proposal_system = Depends(get_email_proposal_system)):
+    # Server-sent events: status updates, then subject/body "delta" events as the
+    # draft is generated, a "field" event as each one completes, and "done".
+    # The draft streams through the async LLM client, so a slow stream holds no
+    # threadpool thread; the blocking research and template lookup run in the pool.
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API Key not configured")
 
+    async def events():
+        yield sse_event("status", {"stage": "researching"})
+        try:
+            response = await run_in_threadpool(get_company_and_person_info_cached, request.company_name, request.decision_maker, request.decision_maker_position, request.product_description)
+            req_info = format_response(response, "research")
+            personality_type = req_info.get('decision_maker_profile', {}).get('personality_type', '')
+
+            yield sse_event("status", {"stage": "drafting"})
+            if not proposal_system.indexes:
+                raise ValueError("FAISS index has not been created. No templates available.")
+            template = await run_in_threadpool(proposal_system.retrieve_best_template, EMAIL_PROPOSAL_QUERY, "email")
+            parser = IncrementalJSONFields()
+            chunks = proposal_system.astream_email(
+                template=template,
+                situation="email",
+                company_name=request.company_name,
+                decision_maker=request.decision_maker,
+                decision_maker_position=request.decision_maker_position,
+                req_info=json.dumps(req_info),
+                product_description=request.product_description,
+                sender_name=request.sender_name,
+                sender_position=request.sender_position,
+                sender_company=request.sender_company
+            )
+            async for chunk in chunks:
+                for kind, key, value in parser.feed(chunk):
+                    if key in ("subject", "body"):
+                        yield sse_event(kind, {"field": key, "value": value})
+
+            yield sse_event("done", {
+                "subject": parser.fields.get("subject"),
+                "body": parser.fields.get("body"),
+                "personality_type": personality_type
+            })
+        except Exception as e:
+            print(f"Error streaming email proposal: {e}")
+            yield sse_event("error", {"detail": getattr(e, "detail", str(e))})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def format_response(response, schema=None):
+    # Extract and validate the JSON in an LLM reply; `schema` is a structured_output.SCHEMAS key
+    json_string = response["choices"][0]["message"]["content"]
     try:
-        # First attempt: try to parse the candidate as JSON.
-        return json.loads(candidate)
-    except json.JSONDecodeError as e:
+        return parse_structured(json_string, schema)
+    except StructuredOutputError as e:
         print(f"Error parsing JSON response: {e}")
-        # If the error message indicates control characters, try escaping them
-        if "Invalid control character" in str(e):
-            fixed_candidate = re.sub(r'(?<!\\)(\n)', r'\\n', candidate)
-            try:
-                return json.loads(fixed_candidate)
-            except (json.JSONDecodeError, ValueError) as e2:
-                print(f"Error parsing JSON after fixing control characters: {e2}")
-        else:
-            # You can add further fixes here if needed.
-            pass
-
-        print("Problematic response:", candidate)
+        print("Problematic response:", json_string)
         raise HTTPException(status_code=500, detail="Invalid response format from API")
 
 
@@ -1265,18 +1680,18 @@ async def send_email(email: EmailData, user_id: str, user_email: str, encrypted_
                     <!-- Tracking Pixel (Hidden) -->
                     <tr>
                         <td>
-                            <img src="https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net/track/{tracking_id}" width="3" height="3" alt="tracking pixel" style="display: none;">
+                            <img src="{TRACKING_BASE_URL}/track/{tracking_id}" width="3" height="3" alt="tracking pixel" style="display: none;">
                         </td>
                     </tr>
 
                     <!-- Action Buttons -->
                     <tr>
                         <td style="padding-top: 20px;">
-                            <a href="https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net/track-response/{tracking_id}/interested"
+                            <a href="{TRACKING_BASE_URL}/track-response/{tracking_id}/interested"
                                 style="display: inline-block; background: rgb(89,227,167); color: #ffffff; text-decoration: none; padding: 12px 24px; border-radius: 5px; font-size: 16px; margin-right: 10px;">
                                 Interested
                             </a>
-                            <a href="https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net/track-response/{tracking_id}/not-interested"
+                            <a href="{TRACKING_BASE_URL}/track-response/{tracking_id}/not-interested"
                                 style="display: inline-block; background: #e74c3c; color: #ffffff; text-decoration: none; padding: 12px 24px; border-radius: 5px; font-size: 16px;">
                                 Not Interested
                             </a>
@@ -1301,11 +1716,7 @@ async def send_email(email: EmailData, user_id: str, user_email: str, encrypted_
     msg.attach(MIMEText(html_body, 'html'))
 
     try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.ehlo()
-            server.starttls()
-            server.ehlo()
-            server.login(user_email, decrypted_password)
+        with smtp_connection(smtp_server, smtp_port, user_email, decrypted_password) as server:
             server.sendmail(user_email, recipient, msg.as_string())
         
         # Send notification email to the sender
@@ -1359,7 +1770,7 @@ async def send_email(email: EmailData, user_id: str, user_email: str, encrypted_
 
         send_notification_email(sender_email, "Email Sent Notification", html_body)
 
-        return {"message": "Email sent!"}
+        return {"message": "Email sent!", "tracking_id": tracking_id}
     except Exception as e:
         print(f"Email Sending Error: {e}")  # Debugging: Print the email sending error
         raise HTTPException(status_code=500, detail=f"Error sending email: {e}")
@@ -1372,11 +1783,7 @@ def send_notification_email(to_email: str, subject: str, body: str, smtp_server:
     msg.attach(MIMEText(body, 'html'))
 
     try:
-        with smtplib.SMTP(smtp_server, SMTP_PORT) as server:
-            server.ehlo()
-            server.starttls()
-            server.ehlo()
-            server.login(os.getenv('EMAIL_USERNAME'), os.getenv('EMAIL_PASSWORD'))
+        with smtp_connection(smtp_server, SMTP_PORT, os.getenv('EMAIL_USERNAME'), os.getenv('EMAIL_PASSWORD')) as server:
             server.sendmail(os.getenv('EMAIL_USERNAME'), to_email, msg.as_string())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending email: {e}")
@@ -1712,31 +2119,30 @@ async def track_response(tracking_id: str, response: str):
         db.close()
 
 @app.post("/email-reminder")
-def get_email_reminder(tracking_id: str, user_id: str, request: ReminderRequest, db: Session = Depends(get_db)):
+def get_email_reminder(tracking_id: str, user_id: str, request: ReminderRequest, db: Session = Depends(get_db), proposal_system = Depends(get_email_proposal_system)):
     email = db.query(EmailStatus).filter(EmailStatus.id == tracking_id, EmailStatus.user_id == user_id).first()
     if not email:
         raise HTTPException(status_code=404, detail="Email not found or you do not have permission to send a reminder for this email")
+    tag_usage(user_id=user_id, product_id=email.product_id)
     
     company_name = email.company_name
     decision_maker = email.dm_name
     body = email.email_body
     product_description = db.query(ProductDetails).filter(ProductDetails.product_id == email.product_id).first().product_description
     dm_pos = email.dm_position
-    response = get_company_and_person_info(decision_maker, decision_maker, dm_pos, product_description)
+    response = get_company_and_person_info_cached(company_name, decision_maker, dm_pos, product_description)
 
     print("Information fetched for ", decision_maker," from the company ", company_name,":", response)
 
-    req_info = format_response(response)
+    req_info = format_response(response, "research")
 
     query = f"Personalised {request.type[0].upper() + request.type[1:]} proposal based on Target Company and Decision Maker"
 
     situation = request.type
-
-    proposal_system = EmailProposalSystem(pdf_paths)
         
     # Mock request data
     mock_request = {
-        "product_description": request.product_description,
+        "product_description": product_description,
         "sender_name": request.sender_name,
         "sender_position": request.sender_position,
         "sender_company": request.sender_company
@@ -1754,7 +2160,8 @@ def get_email_reminder(tracking_id: str, user_id: str, request: ReminderRequest,
         **mock_request
     )
 
-    formatted_response = format_response(response)
+    response, _ = response
+    formatted_response = format_response(response, "draft")
 
     subject = formatted_response.get("subject")
     body = formatted_response.get("body")
@@ -1866,7 +2273,7 @@ async def send_followup_email(user_id: str, user_email: str, encrypted_password:
         decrypted_password = decrypt_password(encrypted_password)
 
         # Identify SMTP server
-        smtp_server = identify_smtp_server(user_email)
+        smtp_server, smtp_port = identify_smtp_server(user_email)
 
         # Send follow-up email
         msg = MIMEMultipart()
@@ -1900,18 +2307,18 @@ async def send_followup_email(user_id: str, user_email: str, encrypted_password:
                     <!-- Tracking Pixel (Hidden) -->
                     <tr>
                         <td>
-                            <img src="https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net/track/{followup_data.followup_id}" width="3" height="3" alt="tracking pixel" style="display: none;">
+                            <img src="{TRACKING_BASE_URL}/track/{followup_data.followup_id}" width="3" height="3" alt="tracking pixel" style="display: none;">
                         </td>
                     </tr>
 
                     <!-- Action Buttons -->
                     <tr>
                         <td style="padding-top: 20px;">
-                            <a href="https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net/track-response/{followup_data.followup_id}/interested"
+                            <a href="{TRACKING_BASE_URL}/track-response/{followup_data.followup_id}/interested"
                                 style="display: inline-block; background: rgb(89,227,167); color: #ffffff; text-decoration: none; padding: 12px 24px; border-radius: 5px; font-size: 16px; margin-right: 10px;">
                                 Interested
                             </a>
-                            <a href="https://sales-ai-agent-backend-e3h0gzfxduabejdz.centralindia-01.azurewebsites.net/track-response/{followup_data.followup_id}/not-interested"
+                            <a href="{TRACKING_BASE_URL}/track-response/{followup_data.followup_id}/not-interested"
                                 style="display: inline-block; background: #e74c3c; color: #ffffff; text-decoration: none; padding: 12px 24px; border-radius: 5px; font-size: 16px;">
                                 Not Interested
                             </a>
@@ -1930,11 +2337,7 @@ async def send_followup_email(user_id: str, user_email: str, encrypted_password:
         msg.attach(MIMEText(html_body, 'html'))
 
         try:
-            with smtplib.SMTP(smtp_server, SMTP_PORT) as server:
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                server.login(user_email, decrypted_password)
+            with smtp_connection(smtp_server, smtp_port, user_email, decrypted_password) as server:
                 server.sendmail(user_email, followup.recipient, msg.as_string())
 
             # Send notification email to the sender
@@ -2444,7 +2847,7 @@ def subscribe_user(request: SubscriptionRequest, user_id: str, db: Session = Dep
         raise HTTPException(status_code=404, detail="User not found")
 
     # Create Razorpay order
-    razorpay_order = razorpay_client.order.create({
+    razorpay_order = get_razorpay_client().order.create({
         "amount": int(request.amount * 100),  # amount in paise
         "currency": "INR",
         "payment_capture": "1"
@@ -2476,6 +2879,8 @@ def payment_success(payment: PaymentSuccess, db: Session = Depends(get_db)):
         'razorpay_payment_id': payment.payment_id,
         'razorpay_signature': payment.signature
     }
+    import razorpay
+    razorpay_client = get_razorpay_client()
     try:
         razorpay_client.utility.verify_payment_signature(params_dict)
     except razorpay.errors.SignatureVerificationError:
@@ -0,0 +1,101 @@
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+# Compare embedding backends for the template retriever:
+#   python bench_embeddings.py [backend ...]
+#
+# Each backend runs in its own subprocess so that import time and resident
+# memory are measured in isolation. Reports model load time, encode latency
+# (single query and full template batch), peak RSS and top-1 template
+# agreement with the sentence-transformers reference.
+
+REFERENCE_BACKEND = "sentence-transformers"
+REPEATS = 20
+QUERIES = [
+    "Personalised Email proposal based on Target Company and Decision Maker",
+    "Personalised Followup proposal based on Target Company and Decision Maker",
+    "Personalised Breakup proposal based on Target Company and Decision Maker",
+    "Finding a Decision Maker Introduction",
+    "Need to contact decision maker about supply chain improvements",
+    "Checking in after no reply to my last email",
+    "Last attempt before closing the file",
+]
+
+
+def _load_templates():
+    from config import TEMPLATE_PDF_PATHS
+    from email_proposal import EmailProposalSystem
+
+    # Parse the PDFs without embedding them; the backend under test does that.
+    loader = EmailProposalSystem.__new__(EmailProposalSystem)
+    templates = loader._load_all_templates(TEMPLATE_PDF_PATHS)
+    return [template['title'] + " " + template['content'] for category in templates for template in templates[category]]
+
+
+def run_worker(backend_name):
+    import numpy as np
+
+    texts = _load_templates()
+    queries = QUERIES + [text.split(" ", 8)[-1][:200] for text in texts]
+
+    start = time.perf_counter()
+    from embeddings import get_embedding_backend
+    backend = get_embedding_backend(backend_name)
+    load_seconds = time.perf_counter() - start
+
+    backend.encode(QUERIES[0])  # warm-up
+    single = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        backend.encode(QUERIES[0])
+        single.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    template_embeddings = backend.encode(texts)
+    batch_seconds = time.perf_counter() - start
+
+    query_embeddings = backend.encode(queries)
+    distances = ((query_embeddings[:, None, :] - template_embeddings[None, :, :]) ** 2).sum(axis=2)
+    top1 = np.argmin(distances, axis=1).tolist()
+
+    print(json.dumps({
+        "backend": backend_name,
+        "load_seconds": load_seconds,
+        "single_query_ms_p50": statistics.median(single) * 1000,
+        "single_query_ms_max": max(single) * 1000,
+        "template_batch_ms": batch_seconds * 1000,
+        "templates": len(texts),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "top1": top1,
+    }))
+
+
+def main(backends):
+    results = {}
+    for backend_name in backends:
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", backend_name],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[backend_name] = json.loads(output.strip().splitlines()[-1])
+
+    reference = results.get(REFERENCE_BACKEND)
+    print(f"{'backend':<24}{'load s':>8}{'query p50 ms':>14}{'batch ms':>10}{'peak RSS MB':>13}{'top-1 agree':>13}")
+    for backend_name, result in results.items():
+        agreement = "-"
+        if reference and backend_name != REFERENCE_BACKEND:
+            matches = sum(a == b for a, b in zip(result["top1"], reference["top1"]))
+            agreement = f"{matches}/{len(reference['top1'])}"
+        print(f"{backend_name:<24}{result['load_seconds']:>8.2f}{result['single_query_ms_p50']:>14.2f}"
+              f"{result['template_batch_ms']:>10.1f}{result['peak_rss_mb']:>13.0f}{agreement:>13}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        run_worker(sys.argv[2])
+    else:
+        main(sys.argv[1:] or ["sentence-transformers", "onnx-int8"])
@@ -0,0 +1,98 @@
+import json
+import statistics
+import sys
+import time
+
+# Compare the two-pass proposal flow (research call, then draft call) with the
+# single-pass research-and-draft request:
+#   python bench_single_pass.py [companies.json]
+#
+# companies.json is a list of {"company", "decision_maker", "position"}
+# objects; a small built-in sample is used otherwise. Calls the live Perplexity
+# API (PERPLEXITY_API_KEY must be set) and bypasses the research cache. Reports
+# end-to-end latency and token cost per company for each flow.
+
+PRODUCT_DESCRIPTION = "AI sales agent that finds decision makers and drafts personalized outreach emails"
+SENDER = {"sender_name": "Alex Morgan", "sender_position": "Account Executive", "sender_company": "Lead Stream"}
+SAMPLE_COMPANIES = [
+    {"company": "Microsoft", "decision_maker": "Satya Nadella", "position": "CEO"},
+    {"company": "Shopify", "decision_maker": "Harley Finkelstein", "position": "President"},
+    {"company": "Freshworks", "decision_maker": "Dennis Woodside", "position": "CEO"},
+]
+PRICE_PER_TOKEN = 0.0000002  # sonar, input and output
+
+
+def _usage(response):
+    usage = response.get("usage", {})
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def run_two_pass(proposal_system, format_response, entry):
+    from info_gather import get_company_and_person_info
+
+    start = time.perf_counter()
+    research = get_company_and_person_info(entry["company"], entry["decision_maker"], entry["position"], PRODUCT_DESCRIPTION)
+    req_info = format_response(research)
+    draft, _ = proposal_system.generate_email(
+        query="Personalised Email proposal based on Target Company and Decision Maker",
+        situation="email",
+        company_name=entry["company"],
+        decision_maker=entry["decision_maker"],
+        decision_maker_position=entry["position"],
+        req_info=json.dumps(req_info),
+        product_description=PRODUCT_DESCRIPTION,
+        **SENDER
+    )
+    format_response(draft)
+    seconds = time.perf_counter() - start
+    tokens = [sum(pair) for pair in zip(_usage(research), _usage(draft))]
+    return seconds, tokens
+
+
+def run_single_pass(proposal_system, format_response, entry):
+    start = time.perf_counter()
+    response = proposal_system.generate_email_single_pass(
+        query="Personalised Email proposal based on Target Company and Decision Maker",
+        situation="email",
+        company_name=entry["company"],
+        decision_maker=entry["decision_maker"],
+        decision_maker_position=entry["position"],
+        product_description=PRODUCT_DESCRIPTION,
+        **SENDER
+    )
+    result = format_response(response)
+    seconds = time.perf_counter() - start
+    if not result.get("email", {}).get("body"):
+        print(f"warning: single-pass response for {entry['company']} has no email body")
+    return seconds, list(_usage(response))
+
+
+def main(path=None):
+    from app import format_response, get_email_proposal_system
+
+    companies = SAMPLE_COMPANIES
+    if path:
+        with open(path) as f:
+            companies = json.load(f)
+    proposal_system = get_email_proposal_system()
+
+    results = {"two-pass": [], "single-pass": []}
+    for entry in companies:
+        for flow, run in (("two-pass", run_two_pass), ("single-pass", run_single_pass)):
+            seconds, (prompt_tokens, completion_tokens) = run(proposal_system, format_response, entry)
+            results[flow].append({"seconds": seconds, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+            print(f"{flow:<12} {entry['company']:<20} {seconds:6.2f}s  {prompt_tokens:>6} in  {completion_tokens:>6} out")
+
+    print()
+    print(f"{'flow':<12}{'p50 s':>8}{'mean s':>8}{'in tok':>9}{'out tok':>9}{'$/company':>12}")
+    for flow, runs in results.items():
+        seconds = [run["seconds"] for run in runs]
+        prompt_tokens = statistics.mean(run["prompt_tokens"] for run in runs)
+        completion_tokens = statistics.mean(run["completion_tokens"] for run in runs)
+        cost = (prompt_tokens + completion_tokens) * PRICE_PER_TOKEN
+        print(f"{flow:<12}{statistics.median(seconds):>8.2f}{statistics.mean(seconds):>8.2f}"
+              f"{prompt_tokens:>9.0f}{completion_tokens:>9.0f}{cost:>12.6f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,147 @@
+import json
+import random
+import re
+import sys
+import time
+
+# Corpus check, fuzz run and benchmark for structured_output:
+#   python bench_structured_output.py [fuzz_iterations]
+#
+# 1. Every reply in structured_output_corpus.json (malformed replies collected
+#    from the pipeline) must parse or fail as its "expect" field says.
+# 2. Fuzz: well-formed replies are mutated (truncated, raw newlines, trailing
+#    commas, comments, fences, prose); the parser must only ever raise
+#    StructuredOutputError. Recovery rates are compared with the old regex parser.
+# 3. Benchmark: parse time per reply for both parsers, for well-formed and
+#    malformed replies.
+
+from structured_output import StructuredOutputError, parse_structured
+
+CORPUS_PATH = "structured_output_corpus.json"
+BENCH_REPEATS = 200
+
+
+def legacy_parse(json_string):
+    """The regex-based format_response this module replaced, for comparison"""
+    json_string = json_string.strip()
+    match = re.search(r'```json\s*(.*?)\s*```', json_string, re.DOTALL)
+    candidate = match.group(1).strip() if match else json_string
+    candidate = re.sub(r'(?m)^\s*//.*$', '', candidate)
+    candidate = re.sub(r'(?m)([^:])//.*$', r'\1', candidate)
+    candidate = re.sub(r',\s*([}\]])', r'\1', candidate)
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError as e:
+        if "Invalid control character" in str(e):
+            return json.loads(re.sub(r'(?<!\\)(\n)', r'\\n', candidate))
+        raise
+
+
+def _legacy_ok(content):
+    try:
+        legacy_parse(content)
+        return True
+    except ValueError:
+        return False
+
+
+def _new_ok(content, schema):
+    try:
+        parse_structured(content, schema)
+        return True
+    except StructuredOutputError:
+        return False
+
+
+def check_corpus(corpus):
+    failures = 0
+    for case in corpus:
+        ok = _new_ok(case["content"], case["schema"])
+        expected = case["expect"] == "ok"
+        status = "pass" if ok == expected else "FAIL"
+        failures += ok != expected
+        print(f"{status:<5} {case['name']:<40} new={'ok' if ok else 'error':<6} legacy={'ok' if _legacy_ok(case['content']) else 'error'}")
+    return failures
+
+
+def mutate(content, rng):
+    mutation = rng.choice(["truncate", "newline", "trailing_comma", "comment", "fence", "prose", "literal"])
+    if mutation == "truncate":
+        return content[:rng.randint(len(content) // 2, len(content))]
+    if mutation == "newline":
+        quotes = [m.start() for m in re.finditer(r'[a-z] [a-z]', content)]
+        if quotes:
+            i = rng.choice(quotes) + 1
+            return content[:i] + "\n" + content[i + 1:]
+    if mutation == "trailing_comma":
+        closers = [i for i, c in enumerate(content) if c in '}]']
+        if closers:
+            i = rng.choice(closers)
+            return content[:i] + ",\n" + content[i:]
+    if mutation == "comment":
+        commas = [i for i, c in enumerate(content) if c == ',']
+        if commas:
+            i = rng.choice(commas) + 1
+            return content[:i] + " // note\n" + content[i:]
+    if mutation == "fence":
+        return "```json\n" + content + "\n```"
+    if mutation == "prose":
+        return "Here is the JSON you asked for:\n" + content + "\n\nLet me know if you need anything else [1]."
+    if mutation == "literal":
+        return content.replace('"verified": true', '"verified": True')
+    return content
+
+
+def fuzz(corpus, iterations, seed=7):
+    rng = random.Random(seed)
+    seeds = [case for case in corpus if case["expect"] == "ok"]
+    new_ok = legacy_ok = crashes = 0
+    for _ in range(iterations):
+        case = rng.choice(seeds)
+        content = case["content"]
+        for _ in range(rng.randint(1, 3)):
+            content = mutate(content, rng)
+        try:
+            parse_structured(content, case["schema"])
+            new_ok += 1
+        except StructuredOutputError:
+            pass
+        except Exception as e:
+            crashes += 1
+            print(f"CRASH on {case['name']}: {e!r}\n{content[:300]!r}")
+        legacy_ok += _legacy_ok(content)
+    print(f"fuzz: {iterations} mutated replies, recovered new={new_ok / iterations:.1%} legacy={legacy_ok / iterations:.1%}, crashes={crashes}")
+    return crashes
+
+
+def bench(corpus):
+    # Reported separately: well-formed replies take the json.loads / raw_decode fast
+    # path, malformed ones go through the repair scanner (which the legacy parser
+    # mostly gives up on, so its time there is the cost of failing)
+    groups = {
+        "well-formed": [case["content"] for case in corpus if _legacy_ok(case["content"])],
+        "malformed": [case["content"] for case in corpus if not _legacy_ok(case["content"])],
+    }
+    for group, contents in groups.items():
+        for name, parse in (("structured_output", lambda c: _new_ok(c, None)), ("legacy", _legacy_ok)):
+            start = time.perf_counter()
+            for _ in range(BENCH_REPEATS):
+                for content in contents:
+                    parse(content)
+            per_reply = (time.perf_counter() - start) / (BENCH_REPEATS * len(contents))
+            print(f"bench: {group:<12} {name:<18} {per_reply * 1e6:8.1f} us/reply")
+
+
+def main(iterations=2000):
+    with open(CORPUS_PATH) as f:
+        corpus = json.load(f)
+    failures = check_corpus(corpus)
+    crashes = fuzz(corpus, int(iterations))
+    bench(corpus)
+    if failures or crashes:
+        raise SystemExit(f"FAILED: {failures} corpus mismatches, {crashes} crashes")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+import metrics
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with hit/miss counters.
+
+    When `name` is given, hits and misses are also reported to the metrics
+    registry as `<name>_hits` and `<name>_misses`.
+    """
+
+    def __init__(self, maxsize=256, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if self.name:
+            metrics.incr(f"{self.name}_{'misses' if value is _MISSING else 'hits'}")
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
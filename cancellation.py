@@ -0,0 +1,30 @@
+import contextvars
+
+# Cooperative cancellation for work running on behalf of a job.
+#
+# Long-running code calls check_cancelled() between steps; it raises
+# JobCancelled once a stop signal of the current context is set. The signals
+# are threading.Events kept in a contextvar, so they follow the work into
+# threads started with contextvars.copy_context().run. This module has no
+# dependencies, so helpers like email_verifier can check for cancellation
+# without importing the job queue (jobs.py, which re-exports these names).
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it was cancelled, lost its lease or its work is no longer needed"""
+
+
+# Stop signals for work in the current context: the job's own (set by the
+# worker) plus any added by code that fans work out and may abandon some of it
+_stop_events = contextvars.ContextVar("job_stop_events", default=())
+
+
+def set_stop_event(event):
+    """Add `event` to the stop signals checked by check_cancelled() in the current context"""
+    return _stop_events.set(_stop_events.get() + (event,))
+
+
+def check_cancelled():
+    """Raise JobCancelled once any stop signal of the current context is set; a no-op outside a job"""
+    if any(event.is_set() for event in _stop_events.get()):
+        raise JobCancelled("Job cancelled")
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+# Import-time budget check for the API module:
+#   python check_import_time.py [module]
+#
+# Runs `python -X importtime -c "import app"` in a fresh interpreter, fails if
+# the cumulative import time exceeds IMPORT_TIME_BUDGET_MS, or if any heavy
+# dependency that is supposed to load lazily was imported.
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 2000))
+LAZY_MODULES = ["torch", "sentence_transformers", "transformers", "faiss", "PyPDF2", "onnxruntime", "razorpay"]
+
+
+def measure(module):
+    code = f"import sys, {module}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            cumulative_us = int(parts[1])
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return (cumulative_us or 0) / 1000, loaded
+
+
+def main(module="app"):
+    import_ms, loaded = measure(module)
+    print(f"import {module}: {import_ms:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+    failures = []
+    if import_ms > IMPORT_TIME_BUDGET_MS:
+        failures.append(f"import time {import_ms:.0f} ms exceeds budget of {IMPORT_TIME_BUDGET_MS:.0f} ms")
+    if loaded:
+        failures.append(f"heavy modules imported eagerly: {', '.join(loaded)}")
+    if failures:
+        raise SystemExit("FAILED: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
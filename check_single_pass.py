@@ -0,0 +1,78 @@
+import os
+import sys
+
+# Check that PROPOSAL_SINGLE_PASS actually selects the single-pass draft in discovery:
+#   python check_single_pass.py
+#
+# Runs phase 2 (research_candidates) and the phase 3 draft call (get_email_proposal
+# without research, as get_potential_companies makes it) with the flag on and off.
+# The research, draft and cache functions are replaced by recorders, so nothing
+# leaves the process. With the flag on there must be no batched research call and
+# every draft must go through get_email_proposal_single_pass; with it off, research
+# is batched and the draft takes the two-call path.
+
+os.environ.setdefault("PERPLEXITY_API_KEY", "check")
+import app
+
+CANDIDATE = {"name": "Acme", "decision_maker_name": "Jordan Lee", "decision_maker_position": "CEO"}
+RESEARCH = {"choices": [{"message": {"content": '{"company_analysis": {}, "decision_maker_profile": {"personality_type": "INTJ"}, "synergy_points": {}}'}}]}
+DRAFT = '{"subject": "Hi", "body": "<p>Hello</p>"}'
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def record(self, name, result):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return result
+        return call
+
+
+class ProposalSystem:
+    """Stands in for EmailProposalSystem on the two-call path"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def generate_email(self, **kwargs):
+        self.recorder.calls.append("two_call_draft")
+        return {"choices": [{"message": {"content": DRAFT}}]}, "INTJ"
+
+
+def run(single_pass):
+    recorder = Recorder()
+    app.PROPOSAL_SINGLE_PASS = single_pass
+    app.API_KEY = "check"
+    app.get_company_and_person_info_batch_cached = recorder.record("batch_research", [RESEARCH])
+    app.lookup_research = recorder.record("lookup_research", None)
+    app.get_email_proposal_single_pass = recorder.record("single_pass_draft", {"subject": "Hi", "body": "x", "personality_type": "INTJ"})
+
+    researches = app.research_candidates([CANDIDATE], "AI sales agent")
+    request = app.EmailProposalRequest(
+        product_description="AI sales agent", company_name=CANDIDATE["name"], decision_maker=CANDIDATE["decision_maker_name"],
+        decision_maker_position=CANDIDATE["decision_maker_position"], sender_name="Sam", sender_position="AE", sender_company="Lead Stream",
+    )
+    app.get_email_proposal(request, proposal_system=ProposalSystem(recorder), research=researches[0])
+    return recorder.calls
+
+
+def main():
+    failures = []
+    expected = {
+        True: ["lookup_research", "single_pass_draft"],
+        False: ["batch_research", "two_call_draft"],
+    }
+    for single_pass, calls in expected.items():
+        got = run(single_pass)
+        print(f"PROPOSAL_SINGLE_PASS={int(single_pass)}: {', '.join(got)}")
+        if got != calls:
+            failures.append(f"PROPOSAL_SINGLE_PASS={int(single_pass)} made {got}, expected {calls}")
+    if failures:
+        raise SystemExit("FAILED: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
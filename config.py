@@ -8,3 +8,10 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 USERNAME = os.getenv("EMAIL_USERNAME")
 PASSWORD = os.getenv("EMAIL_PASSWORD")
+
+# Template PDFs used by the email proposal system, keyed by situation
+TEMPLATE_PDF_PATHS = {
+    "email": "email-template.pdf",
+    "followup": "followup-template.pdf",
+    "breakup": "breakup-template.pdf"
+}
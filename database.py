@@ -0,0 +1,42 @@
+import os
+import threading
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv()
+
+# Database Configuration
+# The engine is created and the schema is synced by init_db() (called on app
+# startup and by worker entrypoints), not at import time.
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+Base = declarative_base()
+SessionLocal = sessionmaker(autocommit=False, autoflush=True)
+
+_engine = None
+_engine_lock = threading.Lock()
+_schema_ready = False
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if not DATABASE_URL:
+                    raise RuntimeError("DATABASE_URL environment variable is not set")
+                _engine = create_engine(DATABASE_URL)
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def init_db():
+    """Create the engine, bind SessionLocal and create any missing tables"""
+    global _schema_ready
+    engine = get_engine()
+    if not _schema_ready:
+        Base.metadata.create_all(bind=engine)
+        _schema_ready = True
+    return engine
@@ -2,15 +2,100 @@ import PyPDF2
 import re
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+import hashlib
 import json
-from info_gather import chat_completion
+import os
+import threading
+import time
+from info_gather import RESEARCH_INSTRUCTIONS, RESEARCH_JSON_SCHEMA, RESEARCH_SYSTEM_PROMPT
+from llm_client import chat_completion, chat_completion_stream, async_chat_completion_stream, LLMError
+from caching import LRUCache
+from prompt_builder import PromptBuilder
+from embeddings import MODEL_NAME, EMBEDDING_BACKEND, get_embedding_backend
+import metrics
+from usage_tracker import usage_context
+import template_bundle
+
+TEMPLATE_QUERY_CACHE_SIZE = int(os.getenv("TEMPLATE_QUERY_CACHE_SIZE", 256))
+# Seconds between checks of the template PDFs for changes (0 disables the watcher)
+TEMPLATE_WATCH_INTERVAL = float(os.getenv("TEMPLATE_WATCH_INTERVAL", 0))
+# Research and draft in one request: the response carries both outputs
+SINGLE_PASS_MAX_TOKENS = int(os.getenv("SINGLE_PASS_MAX_TOKENS", 1600))
+
+def _template_id(category, template):
+    """Stable 63-bit id for a template, derived from its category, title and content"""
+    digest = hashlib.sha256(f"{category}\0{template['title']}\0{template['content']}".encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)
+
+class TemplateSnapshot:
+    """Immutable view of the loaded templates and their per-category indexes.
+
+    Readers take one reference per call; reloads build a new snapshot and swap
+    it in, so a search never sees a half-updated index.
+    """
+    def __init__(self, version, templates, indexes):
+        self.version = version
+        self.templates = templates
+        self.indexes = indexes
+        self.templates_by_id = {
+            category: {template['id']: template for template in category_templates}
+            for category, category_templates in templates.items()
+        }
+
+    @property
+    def embeddings(self):
+        embeddings = [template['embedding'] for category in self.templates for template in self.templates[category]]
+        return np.stack(embeddings).astype('float32') if embeddings else None
 
 class EmailProposalSystem:
-    def __init__(self, pdf_paths):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.templates = self._load_all_templates(pdf_paths)
-        self._create_faiss_index()
+    def __init__(self, pdf_paths, use_bundle=True, embedding_backend=None):
+        # Embedding backends are not guaranteed to be thread-safe, so encode
+        # calls from concurrent requests are serialised on this lock.
+        self._encode_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._model = None
+        self._watcher = None
+        self.pdf_paths = dict(pdf_paths)
+        self.use_bundle = use_bundle
+        self.embedding_backend = embedding_backend or EMBEDDING_BACKEND
+        # Bundles are only valid for the backend that produced their embeddings
+        self.embedding_key = f"{MODEL_NAME}:{self.embedding_backend}"
+        # Retrieval queries are nearly constant strings, so cache both their
+        # embeddings and the templates they resolve to.
+        self._query_embedding_cache = LRUCache(TEMPLATE_QUERY_CACHE_SIZE, name="template_query_embedding_cache")
+        self._query_result_cache = LRUCache(TEMPLATE_QUERY_CACHE_SIZE, name="template_query_result_cache")
+
+        self._source_mtimes = self._read_source_mtimes()
+        bundle = template_bundle.load_bundle(pdf_paths, self.embedding_key) if use_bundle else None
+        if bundle:
+            # Compiled bundle matches the PDFs: skip parsing and template encoding
+            self._snapshot = self._load_snapshot(bundle["templates"], bundle["indexes"], bundle["embeddings"])
+        else:
+            self._snapshot = self._build_snapshot(self._load_all_templates(pdf_paths))
+            if use_bundle:
+                self._write_bundle()
+
+    @property
+    def templates(self):
+        return self._snapshot.templates
+
+    @property
+    def indexes(self):
+        return self._snapshot.indexes
+
+    @property
+    def embeddings(self):
+        return self._snapshot.embeddings
+
+    @property
+    def model(self):
+        """Embedding backend, loaded on first use (not needed when a bundle is loaded until a query arrives)"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = get_embedding_backend(self.embedding_backend)
+        return self._model
 
     def _load_all_templates(self, pdf_paths):
         """Load and structure templates from multiple PDFs"""
@@ -77,141 +162,422 @@ class EmailProposalSystem:
             print(f"Error processing {pdf_path}: {str(e)}")
             return []
 
-    def _create_faiss_index(self):
-        """Create unified FAISS index for all templates"""
-        all_embeddings = []
-        self.template_list = []
+    def _build_snapshot(self, templates, previous=None):
+        """Build per-category ID-mapped FAISS indexes for `templates`.
 
-        # Flatten templates and create embeddings
-        for category in self.templates:
-            for template in self.templates[category]:
-                embedding = self.model.encode(template['title'] + " " + template['content'])
+        When a previous snapshot is given, its indexes are cloned and only the
+        templates that were added or removed since are embedded / updated.
+        """
+        for category in templates:
+            # Drop exact duplicates so every id appears once per index
+            unique = {}
+            for template in templates[category]:
+                template['id'] = _template_id(category, template)
+                unique.setdefault(template['id'], template)
+            templates[category] = list(unique.values())
+
+        # Reuse embeddings of unchanged templates; embed the rest in one batched forward pass
+        previous_by_id = previous.templates_by_id if previous else {}
+        to_encode = []
+        for category, category_templates in templates.items():
+            for template in category_templates:
+                existing = previous_by_id.get(category, {}).get(template['id'])
+                if existing is not None:
+                    template['embedding'] = existing['embedding']
+                else:
+                    to_encode.append(template)
+        if to_encode:
+            texts = [template['title'] + " " + template['content'] for template in to_encode]
+            with self._encode_lock:
+                encoded = np.asarray(self.model.encode(texts), dtype='float32')
+            for template, embedding in zip(to_encode, encoded):
                 template['embedding'] = embedding
-                all_embeddings.append(embedding)
-                self.template_list.append(template)
 
-        # Create FAISS index if there are embeddings
-        if all_embeddings:
-            self.index = faiss.IndexFlatL2(len(all_embeddings[0]))
-            self.index.add(np.array(all_embeddings))
-        else:
-            self.index = None
+        indexes = {}
+        added_count = removed_count = 0
+        for category, category_templates in templates.items():
+            old_ids = set(previous_by_id.get(category, {}))
+            new_ids = {template['id'] for template in category_templates}
+            old_index = previous.indexes.get(category) if previous else None
+            index = faiss.clone_index(old_index) if old_index is not None else None
+
+            removed = old_ids - new_ids
+            if index is not None and removed:
+                index.remove_ids(np.array(sorted(removed), dtype='int64'))
+            added = [template for template in category_templates if template['id'] not in old_ids]
+            if added:
+                if index is None:
+                    index = faiss.IndexIDMap2(faiss.IndexFlatL2(len(added[0]['embedding'])))
+                index.add_with_ids(
+                    np.stack([template['embedding'] for template in added]).astype('float32'),
+                    np.array([template['id'] for template in added], dtype='int64'),
+                )
+            added_count += len(added)
+            removed_count += len(removed)
+            if index is not None and index.ntotal:
+                indexes[category] = index
+
+        if not indexes:
             print("No templates found to create FAISS index.")
+        snapshot = TemplateSnapshot(previous.version + 1 if previous else 1, templates, indexes)
+        snapshot.added, snapshot.removed = added_count, removed_count
+        return snapshot
+
+    def _load_snapshot(self, templates, indexes, embeddings):
+        """Snapshot from prebuilt per-category indexes and their (memory-mapped) embeddings in a template bundle"""
+        position = 0
+        for category in templates:
+            for template in templates[category]:
+                template['id'] = _template_id(category, template)
+                template['embedding'] = embeddings[position]
+                position += 1
+        indexes = {category: index for category, index in indexes.items() if templates.get(category)}
+        return TemplateSnapshot(1, templates, indexes)
+
+    def _write_bundle(self):
+        snapshot = self._snapshot
+        if not snapshot.indexes:
+            return None
+        try:
+            return template_bundle.write_bundle(self.pdf_paths, self.embedding_key, snapshot.templates, snapshot.embeddings, snapshot.indexes)
+        except OSError as e:
+            print(f"Unable to write template bundle: {e}")
+            return None
+
+    def _read_source_mtimes(self):
+        mtimes = {}
+        for category, path in self.pdf_paths.items():
+            try:
+                mtimes[category] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[category] = None
+        return mtimes
+
+    def reload_templates(self):
+        """Re-read the template PDFs and atomically swap in updated indexes.
 
-    def retrieve_best_template(self, query):
-        """Find most relevant template using semantic search"""
-        if not self.index:
+        Only templates whose text changed are re-embedded and added to / removed
+        from the ID-mapped indexes; in-flight retrievals keep using the snapshot
+        they started with. When no template changed the current snapshot is kept.
+        """
+        with self._reload_lock:
+            # Read before the PDFs are, so an edit made during the reload triggers another one
+            mtimes = self._read_source_mtimes()
+            previous = self._snapshot
+            templates = self._load_all_templates(self.pdf_paths)
+            for category, category_templates in templates.items():
+                if not category_templates and previous.templates.get(category):
+                    # A PDF that fails to parse must not wipe out a working category
+                    print(f"No templates extracted for '{category}', keeping the previous ones")
+                    templates[category] = [dict(template) for template in previous.templates[category]]
+
+            template_ids = {category: {_template_id(category, template) for template in category_templates}
+                            for category, category_templates in templates.items()}
+            if template_ids == {category: set(by_id) for category, by_id in previous.templates_by_id.items()}:
+                # Nothing added, removed or edited (e.g. a PDF was only touched): keep the
+                # snapshot, its version and the retrieval caches keyed on it
+                self._source_mtimes = mtimes
+                metrics.incr("template_reloads_unchanged")
+                print(f"Templates unchanged (version {previous.version})")
+                return {"version": previous.version, "added": 0, "removed": 0}
+
+            snapshot = self._build_snapshot(templates, previous)
+            self._snapshot = snapshot
+            # Only recorded once the reload succeeded, so the watcher retries a failed one
+            self._source_mtimes = mtimes
+            metrics.incr("template_reloads")
+            metrics.set_gauge("template_count", sum(len(t) for t in snapshot.templates.values()))
+            print(f"Templates reloaded (version {snapshot.version}): {snapshot.added} added, {snapshot.removed} removed")
+
+        if self.use_bundle and (snapshot.added or snapshot.removed):
+            self._write_bundle()
+        return {"version": snapshot.version, "added": snapshot.added, "removed": snapshot.removed}
+
+    def start_watching(self, interval=TEMPLATE_WATCH_INTERVAL):
+        """Poll the template PDFs every `interval` seconds and reload them when they change"""
+        if interval <= 0 or self._watcher is not None:
+            return self._watcher
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                if self._read_source_mtimes() != self._source_mtimes:
+                    try:
+                        self.reload_templates()
+                    except Exception as e:
+                        print(f"Error reloading templates: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="template-watcher", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def _search(self, snapshot, query_embeds, k, situation=None):
+        """Search the index for `situation`, or every category when the situation is unknown"""
+        if situation in snapshot.indexes:
+            categories = [situation]
+        else:
+            categories = list(snapshot.indexes)
+
+        results = [[] for _ in range(len(query_embeds))]
+        for category in categories:
+            distances, ids = snapshot.indexes[category].search(query_embeds, k)
+            templates_by_id = snapshot.templates_by_id[category]
+            for row, (row_ids, row_distances) in enumerate(zip(ids, distances)):
+                results[row].extend((templates_by_id[i], float(d)) for i, d in zip(row_ids, row_distances) if i != -1)
+
+        if len(categories) > 1:
+            results = [sorted(row, key=lambda match: match[1])[:k] for row in results]
+        return results
+
+    def _encode_queries(self, queries):
+        """Embed queries, running the model only for those not already in the embedding cache"""
+        embeddings = [self._query_embedding_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            with self._encode_lock:
+                encoded = np.asarray(self.model.encode(missing), dtype='float32')
+            encoded_by_query = dict(zip(missing, encoded))
+            for query, embedding in encoded_by_query.items():
+                self._query_embedding_cache.set(query, embedding)
+            embeddings = [encoded_by_query[query] if embedding is None else embedding for query, embedding in zip(queries, embeddings)]
+        return np.asarray(embeddings, dtype='float32')
+
+    def retrieve_best_template(self, query, situation=None):
+        """Find most relevant template for the situation using semantic search"""
+        matches = self.retrieve_best_templates([query], 1, situation)[0]
+        if not matches:
+            raise ValueError(f"No template found for situation {situation!r}")
+        return matches[0][0]
+
+    def retrieve_best_templates(self, queries, k=1, situation=None):
+        """Find the top-k templates for many queries at once.
+
+        All queries are encoded in one batched forward pass and searched together
+        against the index for `situation` (all categories if it is not known).
+        Returns one list per query of (template, distance) pairs, closest first.
+        """
+        snapshot = self._snapshot
+        if not snapshot.indexes:
             raise ValueError("FAISS index has not been created. No templates available.")
-        query_embed = self.model.encode(query)
-        distances, indices = self.index.search(np.array([query_embed]), 1)
-        return self.template_list[indices[0][0]]
+        if not queries:
+            return []
+        # Cached results are only valid for the snapshot version they were computed against
+        results = [self._query_result_cache.get((snapshot.version, query, situation, k)) for query in queries]
+        missing = [query for query, result in zip(queries, results) if result is None]
+        if missing:
+            searched = dict(zip(missing, self._search(snapshot, self._encode_queries(missing), k, situation)))
+            for query, result in searched.items():
+                self._query_result_cache.set((snapshot.version, query, situation, k), result)
+            results = [searched[query] if result is None else result for query, result in zip(queries, results)]
+        return results
+
+    def generate_email(self, company_name, decision_maker, decision_maker_position, query, situation, template=None, **kwargs):
+        """Generate personalized email using template and context.
 
-    def generate_email(self, company_name, decision_maker, decision_maker_position, query, situation, **kwargs):
-        """Generate personalized email using template and context"""
+        `template` may be passed in when it was already retrieved in bulk via
+        retrieve_best_templates; otherwise it is looked up from `query`.
+        """
         # Check if FAISS index is available
-        if not self.index:
+        if not self.indexes:
             return {
                 "subject": "No Templates Available",
                 "body": "No templates are available to generate an email." 
             }
 
         # Retrieve template
-        template = self.retrieve_best_template(query)
+        if template is None:
+            template = self.retrieve_best_template(query, situation)
 
-        # Build context from kwargs
-        req_info = json.loads(kwargs.get('req_info', '{}'))
+        req_info = json.loads(kwargs.pop('req_info', '{}'))
         print("REQ INFO", req_info)
-        company_analysis = req_info.get('company_analysis', {})
-        decision_maker_profile = req_info.get('decision_maker_profile', {})
-        synergy_points = req_info.get('synergy_points', {})
+        prompt = self.build_email_prompt(template, situation, company_name, decision_maker, decision_maker_position, req_info, **kwargs)
 
-        company_context = f"""
-        Recent News: {company_analysis.get('recent_news', '')}
-        Financial Health: {company_analysis.get('financial_health', '')}
-        Verified Challenges: {', '.join(company_analysis.get('verified_challenges', []))}
-        Strategic Priorities: {', '.join(company_analysis.get('strategic_priorities', []))}
-        """
+        # Call your API here (implementation depends on your API client)
+        return self._call_llm_api(prompt, req_info.get('decision_maker_profile', {}).get('personality_type', ''))
 
-        decision_maker_context = f"""
-        Communication Style: {decision_maker_profile.get('communication_style', '')}
-        Personality Indicators: {decision_maker_profile.get('personality_indicators', '')}
-        Key Achievements: {decision_maker_profile.get('key_achievements', '')}
-        Recent Activities: {decision_maker_profile.get('recent_activities', '')}
-        """
+    def stream_email(self, company_name, decision_maker, decision_maker_position, query, situation, template=None, **kwargs):
+        """Like generate_email, but yields the raw JSON draft text as the LLM produces it"""
+        if not self.indexes:
+            raise ValueError("FAISS index has not been created. No templates available.")
+        if template is None:
+            template = self.retrieve_best_template(query, situation)
 
-        synergy_context = f"""
-        Product Fit: {synergy_points.get('product_fit', '')}
-        Persuasion Levers: {', '.join(synergy_points.get('persuasion_levers', []))}
-        Urgency Factors: {', '.join(synergy_points.get('urgency_factors', []))}
-        """
+        messages = self._stream_messages(template, situation, company_name, decision_maker, decision_maker_position, **kwargs)
+        yield from chat_completion_stream(messages, 900, stage="draft_stream")
+
+    async def astream_email(self, company_name, decision_maker, decision_maker_position, situation, template, **kwargs):
+        """stream_email for async endpoints; the caller retrieves the template (it embeds the query) off the event loop"""
+        messages = self._stream_messages(template, situation, company_name, decision_maker, decision_maker_position, **kwargs)
+        async for chunk in async_chat_completion_stream(messages, 900, stage="draft_stream"):
+            yield chunk
+
+    def _stream_messages(self, template, situation, company_name, decision_maker, decision_maker_position, **kwargs):
+        req_info = json.loads(kwargs.pop('req_info', '{}'))
+        prompt = self.build_email_prompt(template, situation, company_name, decision_maker, decision_maker_position, req_info, **kwargs)
+        return self._email_messages(prompt)
+
+    def generate_email_single_pass(self, company_name, decision_maker, decision_maker_position, query, situation, template=None, **kwargs):
+        """Research the company and draft the email in a single LLM request.
 
-        # Construct AI prompt
-        prompt = f"""
-        Generate a highly personalized email using this template:
-        --- TEMPLATE BEGIN ---
-        {template['content']}
-        --- TEMPLATE END ---
-
-        Context:
-        - Situation Type: {situation}
-        - Product: {kwargs.get('product_description', '')}
-        - Company Context: {company_context}
-        - Decision Maker Profile: {decision_maker_context}
-        - Decision Maker Name: {decision_maker}
-        - Decision Maker Position: {decision_maker_position}
-        - Decision Maker Company Name: {company_name}
-        - Synergy Points: {synergy_context}
-        - Sender Name: {kwargs.get('sender_name', '')}
-        - Sender Position: {kwargs.get('sender_position', '')}
-        - Sender Company: {kwargs.get('sender_company', '')}
-
-        Requirements:
-        1. Maintain template structure exactly
-        2. Personalize content using decision maker's profile
-        3. Address company's specific pain points
-        4. Use {decision_maker_profile.get('communication_style', 'professional')} tone
-        5. You need to format the email correctly e.g,
-        6. Do not assume any additional information not provided in the context. Include a dummy placeholder if needed.
-        7. Include relevant HTML tags for formatting.
-        8. Output JSON with 'subject' and 'body' keys. Use single line value for body instead of showing it multiline so that i can be converted to JSON format without errors.
-        9. Generate a {decision_maker_profile.get('communication_style', '')} click bait subject line and as well as based on the template content.
-
-        
-        IMPORTANT NOTE: 
-        - Keep in mind the max_tokens limit for the API call. So do not compromise on the quality of the email but avoid unnecessary spaces in the response.
-        - STRICTLY, Do not add any other text, content or comments in the output except the JSON output
+        Returns the raw chat completion; its content is a JSON object with a
+        "research" key (same schema as get_company_and_person_info) and an
+        "email" key with "subject" and "body".
         """
-        
+        if not self.indexes:
+            raise ValueError("FAISS index has not been created. No templates available.")
+        if template is None:
+            template = self.retrieve_best_template(query, situation)
 
-        # Call your API here (implementation depends on your API client)
-        return self._call_llm_api(prompt, decision_maker_profile.get('personality_type', ''))
+        prompt = self.build_single_pass_prompt(template, situation, company_name, decision_maker, decision_maker_position, **kwargs)
+        messages = [
+            {"role": "system", "content": f"{RESEARCH_SYSTEM_PROMPT} You also write personalized sales emails from given templates. The output should be a single JSON object."},
+            {"role": "user", "content": prompt}
+        ]
+        with usage_context(stage="single_pass"):
+            response = chat_completion(messages, SINGLE_PASS_MAX_TOKENS)
+        if response is None:
+            raise LLMError("Single-pass research and draft request failed")
+        return response
+
+    def build_single_pass_prompt(self, template, situation, company_name, decision_maker, decision_maker_position, **kwargs):
+        """Build the combined research-and-draft prompt"""
+        def render(field):
+            return "\n".join([
+                f"Product: {field(kwargs.get('product_description', ''))}",
+                f"Company: {company_name}",
+                f"Decision Maker: {decision_maker}, {decision_maker_position}",
+                "",
+                "Step 1 - Research. Analyze the following:",
+                RESEARCH_INSTRUCTIONS,
+                "Step 2 - Draft. Using your research, write a highly personalized email from this template:",
+                "--- TEMPLATE BEGIN ---",
+                template['content'],
+                "--- TEMPLATE END ---",
+                "",
+                "Email context:",
+                f"- Situation Type: {situation}",
+                f"- Sender Name: {kwargs.get('sender_name', '')}",
+                f"- Sender Position: {kwargs.get('sender_position', '')}",
+                f"- Sender Company: {kwargs.get('sender_company', '')}",
+                "",
+                "Email requirements:",
+                "1. Maintain template structure exactly",
+                "2. Personalize content using the decision maker's profile and use their communication style as the tone",
+                "3. Address the company's specific pain points and the synergy points from your research",
+                "4. Do not assume any additional information not provided or researched. Include a dummy placeholder if needed.",
+                "5. Include relevant HTML tags for formatting. Use a single line value for body.",
+                "6. Generate a click bait subject line matching the decision maker's communication style and the template content.",
+                "",
+                "Output strictly as a single JSON object with these keys:",
+                '{"research": ' + RESEARCH_JSON_SCHEMA + ', "email": {"subject": "str", "body": "str"}}',
+                "",
+                "IMPORTANT NOTE:",
+                "- Keep research values concise; spend most of the max_tokens limit on the email.",
+                "- STRICTLY, Do not add any other text, content or comments in the output except the JSON output",
+            ])
+
+        prompt, _ = PromptBuilder().build(render, name="single_pass_prompt")
+        return prompt
+
+    def _email_messages(self, prompt):
+        return [
+            {"role": "system", "content": "You are a helpful assistant that generates emails based on given templates and context. The output should be in JSON format with 'subject' and 'body' keys."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def build_email_prompt(self, template, situation, company_name, decision_maker, decision_maker_position, req_info, **kwargs):
+        """Build the email generation prompt, trimming research fields to the prompt token budget"""
+        company_analysis = req_info.get('company_analysis', {})
+        decision_maker_profile = req_info.get('decision_maker_profile', {})
+        synergy_points = req_info.get('synergy_points', {})
+        communication_style = decision_maker_profile.get('communication_style', '')
+
+        def render(field):
+            return "\n".join([
+                "Generate a highly personalized email using this template:",
+                "--- TEMPLATE BEGIN ---",
+                template['content'],
+                "--- TEMPLATE END ---",
+                "",
+                "Context:",
+                f"- Situation Type: {situation}",
+                f"- Product: {field(kwargs.get('product_description', ''))}",
+                "- Company Context:",
+                f"  Recent News: {field(company_analysis.get('recent_news', ''))}",
+                f"  Financial Health: {field(company_analysis.get('financial_health', ''))}",
+                f"  Verified Challenges: {field(company_analysis.get('verified_challenges', []))}",
+                f"  Strategic Priorities: {field(company_analysis.get('strategic_priorities', []))}",
+                "- Decision Maker Profile:",
+                f"  Communication Style: {field(communication_style)}",
+                f"  Personality Indicators: {field(decision_maker_profile.get('personality_indicators', ''))}",
+                f"  Key Achievements: {field(decision_maker_profile.get('key_achievements', ''))}",
+                f"  Recent Activities: {field(decision_maker_profile.get('recent_activities', ''))}",
+                f"- Decision Maker Name: {decision_maker}",
+                f"- Decision Maker Position: {decision_maker_position}",
+                f"- Decision Maker Company Name: {company_name}",
+                "- Synergy Points:",
+                f"  Product Fit: {field(synergy_points.get('product_fit', ''))}",
+                f"  Persuasion Levers: {field(synergy_points.get('persuasion_levers', []))}",
+                f"  Urgency Factors: {field(synergy_points.get('urgency_factors', []))}",
+                f"- Sender Name: {kwargs.get('sender_name', '')}",
+                f"- Sender Position: {kwargs.get('sender_position', '')}",
+                f"- Sender Company: {kwargs.get('sender_company', '')}",
+                "",
+                "Requirements:",
+                "1. Maintain template structure exactly",
+                "2. Personalize content using decision maker's profile",
+                "3. Address company's specific pain points",
+                f"4. Use {field(communication_style or 'professional')} tone",
+                "5. You need to format the email correctly e.g,",
+                "6. Do not assume any additional information not provided in the context. Include a dummy placeholder if needed.",
+                "7. Include relevant HTML tags for formatting.",
+                "8. Output JSON with 'subject' and 'body' keys. Use single line value for body instead of showing it multiline so that i can be converted to JSON format without errors.",
+                f"9. Generate a {field(communication_style)} click bait subject line and as well as based on the template content.",
+                "",
+                "IMPORTANT NOTE:",
+                "- Keep in mind the max_tokens limit for the API call. So do not compromise on the quality of the email but avoid unnecessary spaces in the response.",
+                "- STRICTLY, Do not add any other text, content or comments in the output except the JSON output",
+            ])
+
+        prompt, _ = PromptBuilder().build(render, name="email_prompt")
+        return prompt
 
     def _call_llm_api(self, prompt, decision_maker_context=None):
         """Mock API call implementation"""
         # Replace with actual API call
         # call the API with the prompt and get the response
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that generates emails based on given templates and context. The output should be in JSON format with 'subject' and 'body' keys."},
-            {"role": "user", "content": prompt}
-        ]
+        messages = self._email_messages(prompt)
+
+        with usage_context(stage="draft"):
+            response = chat_completion(messages, 900)
+        if response is None:
+            raise LLMError("Email draft request failed")
+        return response, decision_maker_context
+
+
+_proposal_system = None
+_proposal_system_lock = threading.Lock()
+
+def get_proposal_system(pdf_paths):
+    """Return the process-wide EmailProposalSystem, building it on first use"""
+    global _proposal_system
+    if _proposal_system is None:
+        with _proposal_system_lock:
+            if _proposal_system is None:
+                with metrics.timer("proposal_system_build_seconds") as build_timer:
+                    _proposal_system = EmailProposalSystem(pdf_paths)
+                metrics.set_gauge("proposal_system_build_seconds", build_timer.elapsed)
+                print(f"EmailProposalSystem built in {build_timer.elapsed:.2f}s")
+    return _proposal_system
+
+def build_template_bundle(pdf_paths):
+    """Parse and embed the template PDFs and write a fresh compiled bundle"""
+    proposal_system = EmailProposalSystem(pdf_paths, use_bundle=False)
+    if not proposal_system.indexes:
+        raise ValueError("No templates found; template bundle not written.")
+    return proposal_system._write_bundle()
 
-        response = chat_completion(messages, 900)
-        # parse the response to extract the subject and body
-        try:
-            data = response
-            usage = data.get("usage", {})
-            print(f"Input tokens: {usage.get('prompt_tokens', 'N/A') * 0.0000002}")
-            print(f"Output tokens: {usage.get('completion_tokens', 'N/A') * 0.0000002}")
-            print(f"Total tokens: {usage.get('total_tokens', 'N/A')}")
-            return response, decision_maker_context
-        except json.JSONDecodeError:
-            return {
-                "subject": "Error Parsing Response",
-                "body": "Failed to parse the response from the API."
-            }
-        
 
-    
 # Usage Example
 # if __name__ == "__main__":
 #     # Initialize with your PDF paths
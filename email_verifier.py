@@ -3,14 +3,31 @@ import re
 import logging
 import requests
 import concurrent.futures
+import contextvars
+from resilience import RETRYABLE_STATUS_CODES, get_service
+from cancellation import JobCancelled, check_cancelled
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-MAILTESTER_API_URL = "https://happy.mailtester.ninja/ninja"
-MAILTESTER_TOKEN_URL = "https://token.mailtester.ninja/token?key=yourkey"
+MAILTESTER_API_URL = os.getenv("MAILTESTER_API_URL", "https://happy.mailtester.ninja/ninja")
+MAILTESTER_TOKEN_URL = os.getenv("MAILTESTER_TOKEN_URL", "https://token.mailtester.ninja/token?key=yourkey")
 MAILTESTER_API_KEY = os.getenv("MAILTESTER_API_KEY")
+MAILTESTER_TIMEOUT = float(os.getenv("MAILTESTER_TIMEOUT", 15))
+
+_mailtester_service = get_service("mailtester")
+
+def _mailtester_get(url, params=None):
+    response = requests.get(url, params=params, timeout=MAILTESTER_TIMEOUT)
+    # Rate limits and server errors are retried by the resilience layer
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        response.raise_for_status()
+    return response
+
+def mailtester_get(url, params=None, cache_key=None):
+    """GET a MailTester endpoint with retries and the MailTester circuit breaker"""
+    return _mailtester_service.call(_mailtester_get, url, params, cache_key=cache_key)
 
 def is_valid_email_format(email: str) -> bool:
     """Validate email format with strict regex"""
@@ -44,7 +61,7 @@ def generate_email_combinations(first_name: str, last_name: str, domain: str) ->
 
 def get_mailtester_token(api_key: str) -> str:
     """Retrieve the authentication token from MailTester API"""
-    response = requests.get(MAILTESTER_TOKEN_URL.replace("yourkey", api_key))
+    response = mailtester_get(MAILTESTER_TOKEN_URL.replace("yourkey", api_key))
     if response.status_code == 200:
         data = response.json()
         return data.get("token")
@@ -58,7 +75,7 @@ def verify_email_api(email: str, token: str) -> bool:
         "email": email,
         "token": token
     }
-    response = requests.get(MAILTESTER_API_URL, params=params)
+    response = mailtester_get(MAILTESTER_API_URL, params=params, cache_key=email)
     if response.status_code == 200:
         data = response.json()
         logger.info(f"API response for {email}: {data}")
@@ -69,10 +86,12 @@ def verify_email_api(email: str, token: str) -> bool:
             return False, data.get("message")
     else:
         logger.error(f"Failed to verify {email} via API")
-        return False, data.get("message")
+        return False, response.reason
 
 def verify_email_candidate(email: str, token: str) -> str | None:
     """Verify a single email candidate"""
+    status = None
+    check_cancelled()
     if is_valid_email_format(email):
         try:
             emailRef, status = verify_email_api(email, token)
@@ -101,16 +120,22 @@ def find_valid_email(first_name: str, last_name: str, domain: str) -> str | None
     if not token:
         return None, None
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_email = {executor.submit(verify_email_candidate, email, token): email for email in candidates}
+    executor = concurrent.futures.ThreadPoolExecutor()
+    try:
+        future_to_email = {executor.submit(contextvars.copy_context().run, verify_email_candidate, email, token): email for email in candidates}
         for future in concurrent.futures.as_completed(future_to_email):
             email = future_to_email[future]
             try:
                 result, status = future.result()
                 if result:
                     return result, status
+            except JobCancelled:
+                raise
             except Exception as e:
                 logger.error(f"Verification failed for {email}: {str(e)}")
+    finally:
+        # Return on the first accepted address without waiting for the other checks
+        executor.shutdown(wait=False, cancel_futures=True)
 
     logger.info("No deliverable email found")
     return None, None
@@ -1,75 +1,147 @@
-import requests
-import os
 import json
+import os
+import metrics
+from usage_tracker import usage_context
+from structured_output import StructuredOutputError, parse_structured
+from llm_client import chat_completion, LLMError
+from resilience import ServiceUnavailableError
 
-# Set your API key
-API_KEY = os.getenv("PERPLEXITY_API_KEY")
-
-# Function to call the chat completions endpoint
-def chat_completion(messages, tokens):
-    url = "https://api.perplexity.ai/chat/completions"  # Replace with the correct Perplexity chat completions endpoint
-
-    payload = {
-            "model": "sonar",
-            "messages": messages,
-            "max_tokens": tokens,
-            "temperature": 0,
-            "top_p": 0.9,
-        }
-    
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
+# Shared by the research call and the single-pass research-and-draft prompt
+RESEARCH_SYSTEM_PROMPT = "You are a senior business analyst with expertise in enterprise decision-making dynamics."
+RESEARCH_INSTRUCTIONS = (
+    "1. Company Analysis: Provide recent news (past 6 months), financial trends/earnings, key challenges (operational efficiency, market competition, tech adoption), industry ranking, and strategic initiatives.\n"
+    "2. Decision Maker Profile: Describe communication style (data-driven, visionary, pragmatic), personality indicators, Myers-Briggs type (4-5 words with full form), key achievements, and recent activities.\n"
+    "3. Synergy Analysis: Map product capabilities to the company’s needs, align value proposition with the decision maker's style, and list 3 key persuasion leverage points.\n"
+)
+# Batched research: several (company, decision maker) pairs share one request.
+# Each entry is allowed RESEARCH_BATCH_ENTRY_TOKENS of output and a request
+# packs as many entries as fit in RESEARCH_BATCH_MAX_TOKENS.
+RESEARCH_BATCH_MAX_TOKENS = int(os.getenv("RESEARCH_BATCH_MAX_TOKENS", 3600))
+RESEARCH_BATCH_ENTRY_TOKENS = int(os.getenv("RESEARCH_BATCH_ENTRY_TOKENS", 700))
+RESEARCH_JSON_SCHEMA = '{"company_analysis": {"recent_news": "str", "financial_health": "str", "verified_challenges": ["str"], "strategic_priorities": ["str"]}, "decision_maker_profile": {"communication_style": "str", "personality_indicators": "str", "personality_type": "str", "key_achievements": "str", "recent_activities": "str"}, "synergy_points": {"product_fit": "str", "persuasion_levers": ["str"], "urgency_factors": ["str"]}}'
 
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error: {e}")
-        return None
 
-# Function to create chat messages and retrieve information
-def get_company_and_person_info(company_name, person_name, position, product_description):
-    """Enhanced information gathering for hyper-personalized emails"""
+def research_messages(company_name, person_name, position, product_description):
+    """Build the chat messages for the company and decision maker research call"""
     prompt = (
     f"Product: {product_description}\n"
     f"Company: {company_name}\n"
     f"Decision Maker: {person_name}, {position}\n\n"
     "Analyze the following:\n"
-    "1. Company Analysis: Provide recent news (past 6 months), financial trends/earnings, key challenges (operational efficiency, market competition, tech adoption), industry ranking, and strategic initiatives.\n"
-    "2. Decision Maker Profile: Describe communication style (data-driven, visionary, pragmatic), personality indicators, Myers-Briggs type (4-5 words with full form), key achievements, and recent activities.\n"
-    "3. Synergy Analysis: Map product capabilities to the company’s needs, align value proposition with the decision maker's style, and list 3 key persuasion leverage points.\n\n"
+    f"{RESEARCH_INSTRUCTIONS}\n"
     "Output strictly as JSON with these keys:\n"
-    '{"company_analysis": {"recent_news": "str", "financial_health": "str", "verified_challenges": ["str"], "strategic_priorities": ["str"]}, "decision_maker_profile": {"communication_style": "str", "personality_indicators": "str", "personality_type": "str", "key_achievements": "str", "recent_activities": "str"}, "synergy_points": {"product_fit": "str", "persuasion_levers": ["str"], "urgency_factors": ["str"]}}'
+    f"{RESEARCH_JSON_SCHEMA}"
 )
 
     messages = [
         {
             "role": "system",
-            "content": "You are a senior business analyst with expertise in enterprise decision-making dynamics."
+            "content": RESEARCH_SYSTEM_PROMPT
         },
         {
             "role": "user",
             "content": prompt
         }
     ]
+    return messages
 
 
-    try:
-        response = chat_completion(messages, 900)
+def _check_response(response, company_name, person_name):
+    # chat_completion returns None once retries are exhausted or the circuit is open
+    if response is None:
+        raise LLMError(f"Research request failed for {person_name} at {company_name}")
 
-        data = response
-        usage = data.get("usage", {})
-        print(f"Input tokens: {usage.get('prompt_tokens', 'N/A') * 0.0000002}")
-        print(f"Output tokens: {usage.get('completion_tokens', 'N/A') * 0.0000002}")
-        print(f"Total tokens: {usage.get('total_tokens', 'N/A')}")
 
+# Function to create chat messages and retrieve information
+def get_company_and_person_info(company_name, person_name, position, product_description):
+    """Enhanced information gathering for hyper-personalized emails"""
+    messages = research_messages(company_name, person_name, position, product_description)
+
+    try:
+        with usage_context(stage="research"):
+            response = chat_completion(messages, 900)
+        _check_response(response, company_name, person_name)
         return response
     except (json.JSONDecodeError, KeyError) as e:
         return {"error": f"Analysis failed: {str(e)}"}
 
+
+def research_batch_messages(entries, product_description):
+    """Build one research request covering several entries ({"company_name", "person_name", "position"})"""
+    targets = "\n".join(
+        f"[{i}] Company: {entry['company_name']} | Decision Maker: {entry['person_name']}, {entry['position']}"
+        for i, entry in enumerate(entries)
+    )
+    prompt = (
+    f"Product: {product_description}\n\n"
+    f"Targets:\n{targets}\n\n"
+    "For EACH target, analyze the following:\n"
+    f"{RESEARCH_INSTRUCTIONS}\n"
+    "Output strictly as JSON with one result per target, using the target's number as id:\n"
+    '{"results": [{"id": 0, "research": ' + RESEARCH_JSON_SCHEMA + '}]}'
+)
+    return [
+        {"role": "system", "content": RESEARCH_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def pack_research_batches(entries, max_tokens=RESEARCH_BATCH_MAX_TOKENS, entry_tokens=RESEARCH_BATCH_ENTRY_TOKENS):
+    """Split entries into chunks whose expected output fits within max_tokens"""
+    per_request = max(1, max_tokens // entry_tokens)
+    return [entries[i:i + per_request] for i in range(0, len(entries), per_request)]
+
+
+def _parse_batch_results(response):
+    """Map entry id -> research dict from a batch response"""
+    return parse_structured(response["choices"][0]["message"]["content"], "research_batch")
+
+
+def _as_completion(research):
+    # Same shape as a single research response, so callers and the research cache treat both alike
+    return {"choices": [{"message": {"role": "assistant", "content": json.dumps(research)}}]}
+
+
+def get_company_and_person_info_batch(entries, product_description):
+    """Research many (company, decision maker) entries in as few requests as fit the token budget.
+
+    Returns one chat-completion-shaped response per entry, in order. Entries
+    missing from (or malformed in) a batch response fall back to a single
+    get_company_and_person_info call; an entry whose fallback fails gets an
+    {"error": ...} response instead, so it does not sink the rest of the batch.
+    """
+    responses = [None] * len(entries)
+    offset = 0
+    for chunk in pack_research_batches(entries):
+        parsed = {}
+        if len(chunk) > 1:
+            tokens = min(RESEARCH_BATCH_MAX_TOKENS, RESEARCH_BATCH_ENTRY_TOKENS * len(chunk))
+            with usage_context(stage="research_batch"):
+                response = chat_completion(research_batch_messages(chunk, product_description), tokens)
+            if response is not None:
+                try:
+                    parsed = _parse_batch_results(response)
+                except (StructuredOutputError, KeyError, IndexError, TypeError) as e:
+                    print(f"Batch research response could not be parsed: {e}")
+            print(f"Batch research: {len(parsed)}/{len(chunk)} entries in one request")
+
+        for i, entry in enumerate(chunk):
+            if i in parsed:
+                metrics.incr("research_batch_entries")
+                responses[offset + i] = _as_completion(parsed[i])
+            else:
+                if len(chunk) > 1:
+                    metrics.incr("research_batch_fallbacks")
+                try:
+                    responses[offset + i] = get_company_and_person_info(entry["company_name"], entry["person_name"], entry["position"], product_description)
+                except (LLMError, ServiceUnavailableError) as e:
+                    print(f"Research failed for {entry['person_name']} at {entry['company_name']}: {e}")
+                    metrics.incr("research_batch_failures")
+                    responses[offset + i] = {"error": f"Research failed: {e}"}
+        offset += len(chunk)
+    return responses
+
+
 # # Example usage
 # if __name__ == "__main__":
 #     company = "Microsoft"
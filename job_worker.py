@@ -0,0 +1,101 @@
+import contextvars
+import os
+import signal
+import socket
+import threading
+import uuid
+from fastapi import HTTPException
+from database import init_db
+import jobs
+from jobs import JobCancelled, Heartbeat, CANCELLED, FAILED, SUCCEEDED
+
+# Worker process for the discovery job queue (see jobs.py):
+#   python job_worker.py
+#
+# The app also starts these threads in its own process when RUN_JOB_WORKERS=1
+# (the default), since the App Service deploy runs only the web process. Set
+# RUN_JOB_WORKERS=0 on the app when workers run as separate processes.
+#
+# Runs JOB_WORKER_CONCURRENCY worker threads. Each one requeues jobs whose lease
+# expired, claims the oldest queued job and runs the discovery pipeline for it
+# while a heartbeat thread keeps the lease alive. SIGTERM / Ctrl-C stops claiming
+# new jobs and lets the running ones finish.
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+
+
+def run_discovery(job_id, payload):
+    # app is imported here so the worker process only pays for it when it starts
+    import app
+
+    companies = app.get_potential_companies(app.ProductRequest(**payload), job_id=job_id)
+    return {"companies": len(companies)}
+
+
+def run_job(job_id, payload, worker_id):
+    """Run one claimed job to completion and record its outcome"""
+    print(f"{worker_id} running {job_id}")
+    with Heartbeat(job_id, worker_id) as beat:
+        jobs.set_stop_event(beat.stop)
+        try:
+            result = run_discovery(job_id, payload)
+        except JobCancelled:
+            jobs.finish_job(job_id, worker_id, CANCELLED)
+        except HTTPException as e:
+            jobs.finish_job(job_id, worker_id, FAILED, error=str(e.detail))
+        except Exception as e:
+            jobs.finish_job(job_id, worker_id, FAILED, error=repr(e))
+        else:
+            jobs.finish_job(job_id, worker_id, SUCCEEDED, result=result)
+    print(f"{worker_id} finished {job_id}")
+
+
+def work(worker_id, stopping):
+    while not stopping.is_set():
+        try:
+            jobs.recover_expired_jobs()
+            claimed = jobs.claim_job(worker_id)
+        except Exception as e:
+            print(f"{worker_id} could not poll the job queue: {e}")
+            claimed = None
+        if claimed is None:
+            stopping.wait(JOB_POLL_SECONDS)
+            continue
+        job_id, payload = claimed
+        # A fresh context per job, so usage tags and the stop event never leak between jobs
+        contextvars.Context().run(run_job, job_id, payload, worker_id)
+
+
+def start_workers(stopping, daemon=False):
+    """Start JOB_WORKER_CONCURRENCY worker threads that claim jobs until `stopping` is set"""
+    prefix = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    threads = [
+        threading.Thread(target=work, args=(f"{prefix}-{i}", stopping), name=f"job-worker-{i}", daemon=daemon)
+        for i in range(JOB_WORKER_CONCURRENCY)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Started {len(threads)} discovery job workers ({prefix})")
+    return threads
+
+
+def main():
+    init_db()
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        print("Stopping: finishing running jobs")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    threads = start_workers(stopping)
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+if __name__ == "__main__":
+    main()
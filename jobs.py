@@ -0,0 +1,327 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import Column, String, Text, Integer, Boolean, TIMESTAMP
+from sqlalchemy.exc import IntegrityError
+from database import Base, SessionLocal
+import metrics
+import progress
+from cancellation import JobCancelled, check_cancelled, set_stop_event  # re-exported for job code
+
+# Durable queue for company discovery runs.
+#
+# /potential-companies enqueues a row in discovery_jobs and returns its id; the
+# run itself happens on job workers (job_worker.py, started inside the app or
+# as separate processes). Workers claim queued jobs with SELECT ... FOR UPDATE
+# SKIP LOCKED, so any number of them can poll the table without handing out
+# the same job twice. A claimed job holds a lease that the
+# worker extends with heartbeats; when a worker dies the lease expires and the
+# job is queued again (up to JOB_MAX_ATTEMPTS claims). Cancellation is
+# cooperative: the running job sees it at its next check_cancelled() (see
+# cancellation.py).
+#
+# Progress is checkpointed per company in discovery_checkpoints, so a job that
+# is retried, resumed or recovered after a crash continues from each company's
+# last completed stage instead of paying for the searches and LLM calls again.
+# Every checkpoint and state change is also published as a progress event (see
+# progress.py) for clients following the job live.
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 120))
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", 20))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Company checkpoint stages, in pipeline order; REJECTED (no deliverable email) is final
+DISCOVERED = "discovered"
+DM_FOUND = "dm_found"
+EMAIL_VERIFIED = "email_verified"
+DRAFTED = "drafted"
+REJECTED = "rejected"
+
+# Progress events published as a company reaches each stage and when a job ends
+STAGE_EVENTS = {
+    DISCOVERED: "company_found",
+    DM_FOUND: "dm_found",
+    EMAIL_VERIFIED: "dm_verified",
+    REJECTED: "company_rejected",
+    DRAFTED: "draft_ready",
+}
+FINISH_EVENTS = {SUCCEEDED: "done", FAILED: "failed", CANCELLED: "cancelled"}
+
+
+class DiscoveryJob(Base):
+    __tablename__ = "discovery_jobs"
+    id = Column(String, primary_key=True)
+    user_id = Column(String, index=True)
+    product_id = Column(String, index=True)
+    payload = Column(Text, nullable=False)  # JSON of the ProductRequest
+    status = Column(String, default=QUEUED, index=True)
+    cancel_requested = Column(Boolean, default=False)
+    attempts = Column(Integer, default=0)
+    worker_id = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow, index=True)
+    started_at = Column(TIMESTAMP, nullable=True)
+    heartbeat_at = Column(TIMESTAMP, nullable=True)
+    lease_expires_at = Column(TIMESTAMP, nullable=True, index=True)
+    finished_at = Column(TIMESTAMP, nullable=True)
+
+
+class DiscoveryCheckpoint(Base):
+    __tablename__ = "discovery_checkpoints"
+    job_id = Column(String, primary_key=True)
+    company_name = Column(String, primary_key=True)
+    stage = Column(String, nullable=False)
+    data = Column(Text, nullable=False)  # JSON of the company as of `stage`
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+
+def job_to_dict(job):
+    return {
+        "job_id": job.id,
+        "user_id": job.user_id,
+        "product_id": job.product_id,
+        "status": job.status,
+        "cancel_requested": job.cancel_requested,
+        "attempts": job.attempts,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _publish(db, job, event, **data):
+    """Publish a progress event about `job` that is delivered when `db` commits"""
+    if progress.enabled(db):
+        progress.publish(db, event, job_id=job.id, user_id=job.user_id, product_id=job.product_id, **data)
+
+
+def enqueue_job(user_id, product_id, payload):
+    """Queue a discovery run; returns the job id"""
+    db = SessionLocal()
+    try:
+        job = DiscoveryJob(id='job_' + str(uuid.uuid4()), user_id=user_id, product_id=product_id, payload=json.dumps(payload))
+        db.add(job)
+        _publish(db, job, "queued")
+        db.commit()
+        metrics.incr("jobs_enqueued")
+        return job.id
+    finally:
+        db.close()
+
+
+def get_job(job_id):
+    db = SessionLocal()
+    try:
+        job = db.query(DiscoveryJob).filter(DiscoveryJob.id == job_id).first()
+        return job_to_dict(job) if job else None
+    finally:
+        db.close()
+
+
+def request_cancel(job_id):
+    """Cancel a job: queued jobs stop at once, running ones at their next check. Returns the job or None"""
+    db = SessionLocal()
+    try:
+        job = db.query(DiscoveryJob).filter(DiscoveryJob.id == job_id).with_for_update().first()
+        if job is None:
+            return None
+        if job.status == QUEUED:
+            job.status = CANCELLED
+            job.finished_at = datetime.utcnow()
+            _publish(db, job, FINISH_EVENTS[CANCELLED])
+            metrics.incr("jobs_cancelled")
+        elif job.status == RUNNING:
+            job.cancel_requested = True
+        db.commit()
+        return job_to_dict(job)
+    finally:
+        db.close()
+
+
+def recover_expired_jobs():
+    """Requeue running jobs whose lease expired (their worker died), or fail them after JOB_MAX_ATTEMPTS"""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        expired = db.query(DiscoveryJob).filter(
+            DiscoveryJob.status == RUNNING, DiscoveryJob.lease_expires_at < now
+        ).with_for_update(skip_locked=True).all()
+        for job in expired:
+            job.worker_id = None
+            if job.cancel_requested:
+                job.status, job.finished_at = CANCELLED, now
+            elif job.attempts >= JOB_MAX_ATTEMPTS:
+                job.status, job.finished_at = FAILED, now
+                job.error = f"Lease expired after {job.attempts} attempts"
+            else:
+                job.status = QUEUED
+            _publish(db, job, FINISH_EVENTS.get(job.status, "queued"), error=job.error)
+            metrics.incr("jobs_recovered")
+        db.commit()
+        return len(expired)
+    finally:
+        db.close()
+
+
+def claim_job(worker_id):
+    """Claim the oldest queued job for `worker_id`; returns (job_id, payload dict) or None"""
+    db = SessionLocal()
+    try:
+        job = db.query(DiscoveryJob).filter(DiscoveryJob.status == QUEUED).order_by(
+            DiscoveryJob.created_at
+        ).with_for_update(skip_locked=True).first()
+        if job is None:
+            db.rollback()
+            return None
+        now = datetime.utcnow()
+        # Conditional on the status as well, for databases without row locks (SQLite in local runs)
+        claimed = db.query(DiscoveryJob).filter(DiscoveryJob.id == job.id, DiscoveryJob.status == QUEUED).update({
+            DiscoveryJob.status: RUNNING,
+            DiscoveryJob.worker_id: worker_id,
+            DiscoveryJob.attempts: DiscoveryJob.attempts + 1,
+            DiscoveryJob.started_at: now,
+            DiscoveryJob.heartbeat_at: now,
+            DiscoveryJob.lease_expires_at: now + timedelta(seconds=JOB_LEASE_SECONDS),
+        }, synchronize_session=False)
+        if claimed:
+            _publish(db, job, "started")
+        db.commit()
+        if not claimed:
+            return None
+        metrics.incr("jobs_claimed")
+        return job.id, json.loads(job.payload)
+    finally:
+        db.close()
+
+
+def heartbeat(job_id, worker_id):
+    """Extend the lease; returns False when the job should stop (cancel requested or lease lost)"""
+    db = SessionLocal()
+    try:
+        job = db.query(DiscoveryJob).filter(DiscoveryJob.id == job_id).with_for_update().first()
+        if job is None or job.status != RUNNING or job.worker_id != worker_id:
+            db.rollback()
+            return False
+        now = datetime.utcnow()
+        job.heartbeat_at = now
+        job.lease_expires_at = now + timedelta(seconds=JOB_LEASE_SECONDS)
+        db.commit()
+        return not job.cancel_requested
+    finally:
+        db.close()
+
+
+def finish_job(job_id, worker_id, status, result=None, error=None):
+    """Record the outcome of a claimed job, unless another worker has taken it over since"""
+    db = SessionLocal()
+    try:
+        job = db.query(DiscoveryJob).filter(DiscoveryJob.id == job_id).with_for_update().first()
+        if job is None or job.worker_id != worker_id:
+            db.rollback()
+            return False
+        job.status = status
+        job.result = json.dumps(result) if result is not None else None
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        job.lease_expires_at = None
+        _publish(db, job, FINISH_EVENTS[status], error=error, result=result)
+        db.commit()
+        metrics.incr(f"jobs_{status}")
+        return True
+    finally:
+        db.close()
+
+
+def resume_job(job_id):
+    """Queue a failed or cancelled job again; it picks up from its checkpoints. Returns the job or None"""
+    db = SessionLocal()
+    try:
+        job = db.query(DiscoveryJob).filter(DiscoveryJob.id == job_id).with_for_update().first()
+        if job is None:
+            return None
+        if job.status in (FAILED, CANCELLED):
+            job.status = QUEUED
+            job.cancel_requested = False
+            job.attempts = 0
+            job.error = None
+            job.finished_at = None
+            _publish(db, job, "queued")
+            db.commit()
+            metrics.incr("jobs_resumed")
+        return job_to_dict(job)
+    finally:
+        db.close()
+
+
+def save_checkpoint(job_id, company_name, stage, data):
+    """Record that a company of the job reached `stage`; a no-op outside a job"""
+    if not job_id:
+        return
+    for _ in range(2):
+        db = SessionLocal()
+        try:
+            db.merge(DiscoveryCheckpoint(job_id=job_id, company_name=company_name, stage=stage,
+                                         data=json.dumps(data), updated_at=datetime.utcnow()))
+            job = db.get(DiscoveryJob, job_id) if progress.enabled(db) else None
+            if job:
+                _publish(db, job, STAGE_EVENTS[stage], company=progress.company_summary(data.get("company", data)))
+            db.commit()
+            return
+        except IntegrityError:
+            # Another thread inserted the row first; the second merge updates it
+            db.rollback()
+        finally:
+            db.close()
+
+
+def load_checkpoints(job_id):
+    """Checkpoints of a job as [{"company_name", "stage", "data"}], oldest first"""
+    if not job_id:
+        return []
+    db = SessionLocal()
+    try:
+        rows = db.query(DiscoveryCheckpoint).filter(DiscoveryCheckpoint.job_id == job_id).order_by(DiscoveryCheckpoint.updated_at).all()
+        return [{"company_name": row.company_name, "stage": row.stage, "data": json.loads(row.data)} for row in rows]
+    finally:
+        db.close()
+
+
+class Heartbeat:
+    """Background thread that keeps a claimed job's lease alive and sets `stop` when the job must end"""
+
+    def __init__(self, job_id, worker_id, interval=JOB_HEARTBEAT_SECONDS):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.stop = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job_id}", daemon=True)
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            try:
+                if not heartbeat(self.job_id, self.worker_id):
+                    self.stop.set()
+                    return
+            except Exception as e:
+                # A missed beat is fine as long as a later one lands before the lease expires
+                print(f"Heartbeat failed for {self.job_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
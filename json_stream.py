@@ -0,0 +1,116 @@
+import json
+
+_SIMPLE_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_END_OF_STRING = object()
+
+
+class IncrementalJSONFields:
+    """Incrementally scans a streamed JSON object and reports its top-level string fields.
+
+    Feed it text chunks as they arrive from the LLM. Each call to feed() returns
+    a list of events:
+      ("delta", key, text)  - more characters of the string value of `key`
+      ("field", key, value) - the string value of `key` is complete
+    Text before the first '{' (e.g. a ```json fence) and after the closing '}'
+    is ignored, as are nested objects, arrays and non-string values.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.done = False
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = None
+        self._role = None
+        self._expect = 'key'
+        self._key = None
+        self._chars = []
+
+    def feed(self, text):
+        events = []
+        delta = []
+
+        def flush_delta():
+            if delta:
+                events.append(("delta", self._key, ''.join(delta)))
+                delta.clear()
+
+        for char in text:
+            if self.done:
+                break
+            if self._in_string:
+                decoded = self._decode_string_char(char)
+                if decoded is _END_OF_STRING:
+                    self._in_string = False
+                    value = ''.join(self._chars)
+                    if self._role == 'key':
+                        self._key = value
+                    elif self._role == 'value':
+                        flush_delta()
+                        self.fields[self._key] = value
+                        events.append(("field", self._key, value))
+                    continue
+                if decoded:
+                    self._chars.append(decoded)
+                    if self._role == 'value':
+                        delta.append(decoded)
+                continue
+
+            if not self._started:
+                if char == '{':
+                    self._started = True
+                    self._depth = 1
+                    self._expect = 'key'
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._escape = None
+                self._chars = []
+                if self._depth == 1 and self._expect in ('key', 'value'):
+                    self._role = self._expect
+                    self._expect = None
+                else:
+                    self._role = None
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 2:
+                    self._expect = None
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+            elif self._depth == 1 and char == ':':
+                self._expect = 'value'
+            elif self._depth == 1 and char == ',':
+                self._expect = 'key'
+
+        flush_delta()
+        return events
+
+    def _decode_string_char(self, char):
+        """Decode one character inside a string; returns decoded text, '' while inside an escape, or _END_OF_STRING"""
+        if self._escape is None:
+            if char == '\\':
+                self._escape = ''
+                return ''
+            if char == '"':
+                return _END_OF_STRING
+            return char
+        if self._escape == '':
+            if char == 'u':
+                self._escape = 'u'
+                return ''
+            self._escape = None
+            return _SIMPLE_ESCAPES.get(char, char)
+        # Inside a \uXXXX escape
+        self._escape += char
+        if len(self._escape) < 5:
+            return ''
+        code, self._escape = self._escape[1:], None
+        try:
+            return json.loads(f'"\\u{code}"')
+        except ValueError:
+            return ''
+
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import httpx
+import metrics
+import usage_tracker
+from singleflight import SingleFlight, request_key
+from resilience import CircuitOpenError, get_service, is_retryable
+
+# Shared Perplexity client. Every LLM call in the app goes through one pooled,
+# keep-alive httpx client (HTTP/2 when available), so round trips reuse an
+# established TLS connection instead of handshaking each time.
+
+API_KEY = os.getenv("PERPLEXITY_API_KEY")
+# Point at a local stand-in (see standins.py) for offline and load testing
+PERPLEXITY_BASE_URL = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai").rstrip("/")
+CHAT_COMPLETIONS_URL = f"{PERPLEXITY_BASE_URL}/chat/completions"
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 120))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+# Limits matched to the Perplexity usage tier: at most LLM_MAX_CONCURRENCY
+# requests in flight (counted separately for threads and for the event loop),
+# and LLM_RATE_PER_MINUTE requests per minute (with bursts of up to
+# LLM_RATE_BURST) across all callers in this process.
+#
+# Async endpoints stream through an httpx.AsyncClient. It and its semaphore
+# belong to the app's event loop, so they are created by astart() on startup
+# and closed by aclose() on shutdown rather than on first use.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", 50))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", 5))
+
+
+class LLMError(Exception):
+    """Raised when a chat completion request fails or returns an error status"""
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and coroutines"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return how long the caller has to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self._reserve() if self.rate > 0 else 0.0
+        if wait:
+            metrics.observe("llm_rate_limit_wait_seconds", wait)
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve() if self.rate > 0 else 0.0
+        if wait:
+            metrics.observe("llm_rate_limit_wait_seconds", wait)
+            await asyncio.sleep(wait)
+
+
+rate_limiter = TokenBucket(LLM_RATE_PER_MINUTE, LLM_RATE_BURST)
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+_async_client = None
+_async_slots = None
+
+# Identical payloads fired concurrently (e.g. several jobs researching the same
+# popular company) share one upstream request.
+_inflight_requests = SingleFlight(name="llm_requests")
+# Retries, optional hedging and the circuit breaker for the Perplexity API
+_llm_service = get_service("llm")
+
+
+def _client_options():
+    return {
+        "timeout": httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        "headers": {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"},
+    }
+
+
+def get_client():
+    """Return the process-wide pooled HTTP client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                try:
+                    _client = httpx.Client(http2=LLM_HTTP2, **_client_options())
+                except ImportError:
+                    # HTTP/2 needs the optional h2 package (httpx[http2])
+                    print("h2 not installed, using HTTP/1.1 keep-alive for LLM calls")
+                    _client = httpx.Client(**_client_options())
+    return _client
+
+
+class _request_slot:
+    """Holds one of the LLM_MAX_CONCURRENCY request slots for the duration of a call"""
+
+    def __enter__(self):
+        global _in_flight
+        _slots.acquire()
+        with _in_flight_lock:
+            _in_flight += 1
+            metrics.set_gauge("llm_in_flight", _in_flight)
+
+    def __exit__(self, *exc):
+        global _in_flight
+        with _in_flight_lock:
+            _in_flight -= 1
+            metrics.set_gauge("llm_in_flight", _in_flight)
+        _slots.release()
+
+
+def _record_latency(model, started):
+    elapsed = time.perf_counter() - started
+    metrics.observe("llm_request_seconds", elapsed)
+    metrics.observe(f"llm_request_seconds.{model}", elapsed)
+    return elapsed
+
+
+def _record_usage(model, data, elapsed):
+    entry = usage_tracker.record(model, data.get("usage"), elapsed)
+    print(f"LLM call ({model}, {entry['stage']}) took {elapsed:.2f}s: "
+          f"{entry['prompt_tokens']} in / {entry['completion_tokens']} out tokens, ${entry['cost']:.6f}")
+
+
+def post_chat_completion(payload):
+    """POST a chat completion payload and return the decoded JSON response; raises LLMError on failure"""
+    return _inflight_requests.do(request_key(payload), _post_chat_completion, payload)
+
+
+def _post_chat_completion(payload):
+    try:
+        return _llm_service.call(_send_chat_completion, payload, cache_key=request_key(payload))
+    except CircuitOpenError as e:
+        raise LLMError(str(e)) from e
+
+
+def _send_chat_completion(payload):
+    model = payload.get("model", "unknown")
+    with _request_slot():
+        rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = get_client().post(CHAT_COMPLETIONS_URL, json=payload)
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            metrics.incr("llm_request_errors")
+            raise LLMError(str(e)) from e
+        finally:
+            elapsed = _record_latency(model, started)
+    _record_usage(model, data, elapsed)
+    return data
+
+
+def _chat_payload(messages, tokens, model):
+    return {
+            "model": model,
+            "messages": messages,
+            "max_tokens": tokens,
+            "temperature": 0,
+            "top_p": 0.9,
+        }
+
+
+# Function to call the chat completions endpoint
+def chat_completion(messages, tokens, model="sonar"):
+    try:
+        return post_chat_completion(_chat_payload(messages, tokens, model))
+    except LLMError as e:
+        print(f"Error: {e}")
+        return None
+
+
+class _StreamReader:
+    """Turns the server-sent event lines of a streamed completion into text; records usage at the end"""
+
+    def __init__(self, model, stage, started):
+        self.model = model
+        self.stage = stage
+        self.started = started
+        self.first_token = True
+        self.finished = False
+
+    def feed(self, line):
+        """The text carried by one event line, or None; sets `finished` at the last event"""
+        if not line or not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            self.finished = True
+            return None
+        chunk = json.loads(data)
+        choices = chunk.get("choices") or [{}]
+        content = (choices[0].get("delta") or {}).get("content")
+        if content and self.first_token:
+            metrics.observe("llm_stream_first_token_seconds", time.perf_counter() - self.started)
+            self.first_token = False
+        if choices[0].get("finish_reason"):
+            # Generators can resume in a different context, so the stage is passed explicitly
+            with usage_tracker.usage_context(stage=self.stage):
+                _record_usage(self.model, chunk, time.perf_counter() - self.started)
+            self.finished = True
+        return content
+
+
+# Streaming variant: yields the generated text as it arrives over server-sent events
+def chat_completion_stream(messages, tokens, model="sonar", stage=None):
+    payload = dict(_chat_payload(messages, tokens, model), stream=True)
+
+    # Streams are not retried (tokens may already have been yielded), but they
+    # still honour and feed the circuit breaker
+    if not _llm_service.breaker.allow():
+        raise LLMError("llm is unavailable (circuit open)")
+    rate_limiter.acquire()
+    started = time.perf_counter()
+    reader = _StreamReader(model, stage, started)
+    try:
+        # The slot is held until the stream ends or the consumer closes the generator
+        with _request_slot(), get_client().stream("POST", CHAT_COMPLETIONS_URL, json=payload, headers={"Accept": "text/event-stream"}) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                content = reader.feed(line)
+                if content:
+                    yield content
+                if reader.finished:
+                    break
+    except httpx.HTTPError as e:
+        metrics.incr("llm_request_errors")
+        if is_retryable(e):
+            _llm_service.breaker.record_failure()
+        raise LLMError(str(e)) from e
+    else:
+        _llm_service.breaker.record_success()
+    finally:
+        _record_latency(model, started)
+
+
+async def async_chat_completion_stream(messages, tokens, model="sonar", stage=None):
+    """chat_completion_stream for async endpoints: no thread is held while the reply streams"""
+    if _async_client is None:
+        raise LLMError("async LLM client is not started")
+    payload = dict(_chat_payload(messages, tokens, model), stream=True)
+
+    if not _llm_service.breaker.allow():
+        raise LLMError("llm is unavailable (circuit open)")
+    await rate_limiter.acquire_async()
+    started = time.perf_counter()
+    reader = _StreamReader(model, stage, started)
+    try:
+        async with _async_slots, _async_client.stream("POST", CHAT_COMPLETIONS_URL, json=payload, headers={"Accept": "text/event-stream"}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                content = reader.feed(line)
+                if content:
+                    yield content
+                if reader.finished:
+                    break
+    except httpx.HTTPError as e:
+        metrics.incr("llm_request_errors")
+        if is_retryable(e):
+            _llm_service.breaker.record_failure()
+        raise LLMError(str(e)) from e
+    else:
+        _llm_service.breaker.record_success()
+    finally:
+        _record_latency(model, started)
+
+
+async def astart():
+    """Create the async client and its concurrency limit on the running event loop (app startup)"""
+    global _async_client, _async_slots
+    try:
+        _async_client = httpx.AsyncClient(http2=LLM_HTTP2, **_client_options())
+    except ImportError:
+        _async_client = httpx.AsyncClient(**_client_options())
+    _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+async def aclose():
+    """Close the async client (app shutdown)"""
+    global _async_client, _async_slots
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    _async_slots = None
+
+
+def close():
+    """Close the pooled client (called on app shutdown)"""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
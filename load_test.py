@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import logging
+import math
+import os
+import time
+import uuid
+from base64 import b64decode, b64encode
+import httpx
+
+# End-to-end load driver for /potential-companies, /send_email and /track:
+#   python load_test.py [--requests 20] [--concurrency 5] [--endpoints potential-companies,send_email,track]
+#
+# Run it against the app pointed at the local stand-ins (see standins.py) so
+# no paid API is called, e.g.
+#   python standins.py --llm-latency 1.5 &
+#   PERPLEXITY_BASE_URL=... uvicorn app:app --port 8000 &
+#   PERPLEXITY_BASE_URL=... python job_worker.py &
+#   python load_test.py --base-url http://127.0.0.1:8000
+# The driver needs the app's DATABASE_URL, ENCRYPTION_KEY and ENCRYPTION_IV: it
+# creates a load-test user and products directly in the database. Raise
+# LLM_RATE_PER_MINUTE on the app or the Perplexity rate limiter sets the pace.
+#
+# /potential-companies only queues a discovery job, so it is reported twice:
+# the HTTP response ("accepted") and the job succeeding ("completed", polled via
+# /jobs/{job_id}). /track opens the tracking ids /send_email returned.
+
+ENDPOINTS = ("potential-companies", "send_email", "track")
+POLL_INTERVAL = 0.5
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def report(name, latencies, errors, wall_seconds):
+    if not latencies:
+        print(f"{name:<32}{0:>7}{errors:>7}")
+        return
+    print(f"{name:<32}{len(latencies):>7}{errors:>7}{len(latencies) / wall_seconds:>9.2f}"
+          f"{percentile(latencies, 0.50) * 1000:>9.0f}{percentile(latencies, 0.95) * 1000:>9.0f}{percentile(latencies, 0.99) * 1000:>9.0f}")
+
+
+def encrypt_password(password):
+    """Encrypt like the frontend does, so /send_email's decrypt_password accepts it"""
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad
+
+    cipher = AES.new(b64decode(os.environ["ENCRYPTION_KEY"]), AES.MODE_CBC, os.environ["ENCRYPTION_IV"].encode("utf-8"))
+    return b64encode(cipher.encrypt(pad(password.encode("utf-8"), 16))).decode("utf-8")
+
+
+def create_fixtures(products):
+    """Create a load-test user and `products` products; returns (user_id, user_email, [product_id])"""
+    from app import User, ProductDetails
+    from database import SessionLocal, init_db
+
+    init_db()
+    run = uuid.uuid4().hex[:8]
+    user_id = f"user_loadtest_{run}"
+    user_email = f"loadtest+{run}@standin.example"
+    db = SessionLocal()
+    try:
+        db.add(User(id=user_id, username=f"loadtest_{run}", email=user_email, first_name="Load", last_name="Test",
+                    company_name='["Lead Stream"]', position='["Account Executive"]', is_verified=True, company_limit=10000))
+        product_ids = [f"product_loadtest_{run}_{i}" for i in range(products)]
+        for product_id in product_ids:
+            db.add(ProductDetails(product_id=product_id, user_id=user_id, product_name="Lead Stream",
+                                  product_description="AI sales agent that finds decision makers and drafts outreach emails",
+                                  preloading_status=True))
+        db.commit()
+    finally:
+        db.close()
+    return user_id, user_email, product_ids
+
+
+async def run_phase(count, concurrency, task):
+    """Run task(i) count times with at most `concurrency` in flight; returns wall seconds"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with semaphore:
+            await task(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(i) for i in range(count)))
+    return time.perf_counter() - start
+
+
+async def potential_companies(client, args, user_id, product_ids):
+    accepted, completed = [], []
+    errors = {"accepted": 0, "completed": 0}
+
+    async def one(i):
+        product_id = product_ids[i]
+        start = time.perf_counter()
+        response = await client.post("/potential-companies", json={
+            "user_id": user_id, "product_id": product_id, "product_name": "Lead Stream",
+            "product_description": "AI sales agent that finds decision makers and drafts outreach emails",
+            "existing_customers": [], "target_industries": ["SaaS"], "target_geo_loc": ["India"],
+            "sender_position": "Account Executive", "sender_company": "Lead Stream", "limit": args.limit,
+        })
+        if response.status_code != 200:
+            errors["accepted"] += 1
+            return
+        accepted.append(time.perf_counter() - start)
+        job_id = response.json()["job_id"]
+
+        deadline = start + args.timeout
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            job = await client.get(f"/jobs/{job_id}")
+            if job.status_code == 200 and job.json()["status"] in FINISHED_STATUSES:
+                break
+        else:
+            errors["completed"] += 1
+            return
+        if job.json()["status"] == "succeeded":
+            completed.append(time.perf_counter() - start)
+        else:
+            errors["completed"] += 1
+
+    wall = await run_phase(len(product_ids), args.concurrency, one)
+    report("potential-companies (accepted)", accepted, errors["accepted"], wall)
+    report("potential-companies (completed)", completed, errors["completed"], wall)
+
+
+async def send_email(client, args, user_id, user_email, product_id, tracking_ids, quiet=False):
+    latencies, errors = [], 0
+    encrypted_password = encrypt_password("loadtest-password")
+
+    async def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        response = await client.post("/send_email", params={
+            "user_id": user_id, "user_email": user_email, "encrypted_password": encrypted_password,
+        }, json={
+            "recipient_name": "Jordan Lee", "company_name": f"Standin {i}", "company_id": f"company_loadtest_{i}",
+            "dm_position": "CEO", "recipient": f"jordan.lee{i}@standin.example", "subject": "Load test",
+            "body": "Hello from the load test.\nRegards", "sender_name": "Load Test", "sender_company": "Lead Stream",
+            "sender_position": "Account Executive", "product_id": product_id,
+        })
+        if response.status_code != 200:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - start)
+        tracking_ids.append(response.json()["tracking_id"])
+
+    wall = await run_phase(args.requests, args.concurrency, one)
+    if not quiet:
+        report("send_email", latencies, errors, wall)
+
+
+async def track(client, args, tracking_ids):
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        response = await client.get(f"/track/{tracking_ids[i % len(tracking_ids)]}")
+        if response.status_code != 200:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    wall = await run_phase(args.requests, args.concurrency, one)
+    report("track", latencies, errors, wall)
+
+
+async def main(args):
+    endpoints = args.endpoints.split(",")
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    user_id, user_email, product_ids = create_fixtures(args.requests)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    print(f"{'endpoint':<32}{'ok':>7}{'errors':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+        if "potential-companies" in endpoints:
+            await potential_companies(client, args, user_id, product_ids)
+        tracking_ids = []
+        if "send_email" in endpoints:
+            await send_email(client, args, user_id, user_email, product_ids[0], tracking_ids)
+        if "track" in endpoints:
+            if not tracking_ids:
+                # /track needs sent emails to open
+                await send_email(client, args, user_id, user_email, product_ids[0], tracking_ids, quiet=True)
+            if tracking_ids:
+                await track(client, args, tracking_ids)
+            else:
+                print("track: no tracking ids (every /send_email failed)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /potential-companies, /send_email and /track")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--limit", type=int, default=3, help="companies per /potential-companies request")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for a request or discovery job")
+    asyncio.run(main(parser.parse_args()))
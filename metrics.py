@@ -0,0 +1,59 @@
+import threading
+import time
+
+# Simple in-process metrics registry shared by the app and its helper modules.
+# Values are exposed as JSON through the /metrics endpoint in app.py.
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    """Increment a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """Set a gauge to the given value"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """Record an observation such as a duration in seconds or a prompt size"""
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        timing["count"] += 1
+        timing["total"] += value
+        timing["max"] = max(timing["max"], value)
+        timing["last"] = value
+
+
+class timer:
+    """Context manager that records the elapsed time of its block under `name`"""
+
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self._start
+        observe(self.name, self.elapsed)
+        return False
+
+
+def snapshot():
+    """Return a copy of all recorded metrics"""
+    with _lock:
+        timings = {
+            name: dict(timing, avg=timing["total"] / timing["count"] if timing["count"] else 0.0)
+            for name, timing in _timings.items()
+        }
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "timings": timings}
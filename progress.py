@@ -0,0 +1,81 @@
+import asyncio
+import json
+import os
+from sqlalchemy import text
+import metrics
+
+# Live progress of discovery jobs, pushed to clients instead of polled.
+#
+# jobs.py publishes an event with pg_notify on PROGRESS_CHANNEL inside the
+# transaction that records the progress (a checkpoint, a finished job), so
+# clients only hear about work that was committed. The app keeps one LISTEN
+# connection (listen_to_db in app.py) and hands every notification to `broker`,
+# which fans it out to the asyncio queues of the /progress/stream clients
+# subscribed to that user or product. On databases without LISTEN/NOTIFY
+# (SQLite in local runs) nothing is published.
+
+PROGRESS_CHANNEL = "discovery_progress"
+# Events buffered per client; a client that falls further behind loses the oldest
+PROGRESS_QUEUE_SIZE = int(os.getenv("PROGRESS_QUEUE_SIZE", 100))
+# pg_notify rejects payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+# Company fields sent with events; the drafted body is fetched with /get_generated_companies/
+COMPANY_FIELDS = ("name", "domain", "industry", "status", "decision_maker_name", "decision_maker_position",
+                  "decision_maker_email", "subject")
+
+
+def company_summary(company):
+    return {key: company[key] for key in COMPANY_FIELDS if company.get(key) is not None}
+
+
+def enabled(db):
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def publish(db, event, **data):
+    """Send a progress event when `db`'s transaction commits; callers check enabled(db) first"""
+    payload = json.dumps({"event": event, **data}, default=str)
+    if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+        payload = json.dumps({"event": event, **{key: value for key, value in data.items() if key != "company"}}, default=str)
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": PROGRESS_CHANNEL, "payload": payload})
+    metrics.incr("progress_events_published")
+
+
+class ProgressBroker:
+    """Fans events out to the queues of subscribed streams; only use it from the event loop"""
+
+    def __init__(self, queue_size=PROGRESS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._queues = {}  # ("user" | "product", id) -> set of queues
+        self._keys = {}  # queue -> its key
+
+    def subscribe(self, user_id=None, product_id=None):
+        """A queue receiving the events of one product, or of all of a user's products"""
+        key = ("product", product_id) if product_id else ("user", user_id)
+        queue = asyncio.Queue(self.queue_size)
+        self._queues.setdefault(key, set()).add(queue)
+        self._keys[queue] = key
+        metrics.set_gauge("progress_subscribers", len(self._keys))
+        return queue
+
+    def unsubscribe(self, queue):
+        key = self._keys.pop(queue, None)
+        if key is not None:
+            self._queues[key].discard(queue)
+            if not self._queues[key]:
+                del self._queues[key]
+        metrics.set_gauge("progress_subscribers", len(self._keys))
+
+    def dispatch(self, message):
+        """Deliver an event dict to the subscribers of its user_id and product_id"""
+        queues = self._queues.get(("user", message.get("user_id")), set()) | self._queues.get(("product", message.get("product_id")), set())
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+                metrics.incr("progress_events_dropped")
+            queue.put_nowait(message)
+        metrics.incr("progress_events_dispatched")
+
+
+broker = ProgressBroker()
@@ -0,0 +1,65 @@
+import os
+import re
+import metrics
+
+# Prompt size control. Research fields pasted into prompts are trimmed so the
+# whole prompt stays within PROMPT_TOKEN_BUDGET; each field starts with
+# PROMPT_FIELD_TOKEN_BUDGET tokens and is halved until the prompt fits.
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1200))
+PROMPT_FIELD_TOKEN_BUDGET = int(os.getenv("PROMPT_FIELD_TOKEN_BUDGET", 150))
+MIN_FIELD_TOKEN_BUDGET = 20
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Approximate token count (words plus punctuation), close to BPE counts for English prose"""
+    return len(_TOKEN_PATTERN.findall(text or ""))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Collapse whitespace and trim text to about max_tokens, preferring to cut at a sentence end"""
+    text = " ".join(str(text).split())
+    tokens = list(_TOKEN_PATTERN.finditer(text))
+    if len(tokens) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    clipped = text[:tokens[max_tokens - 1].end()]
+    sentence_end = max(clipped.rfind(". "), clipped.rfind("! "), clipped.rfind("? "))
+    if sentence_end > len(clipped) // 2:
+        return clipped[:sentence_end + 1]
+    return clipped.rstrip(" ,;:") + " ..."
+
+
+def format_field(value, max_tokens):
+    """Render a research value (string or list of strings) for a prompt within max_tokens"""
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(str(item) for item in value)
+    return truncate_to_tokens(value or "", max_tokens)
+
+
+class PromptBuilder:
+    """Builds a prompt whose truncatable fields are shrunk until it fits the token budget.
+
+    `render(field)` must return the full prompt text, passing every long,
+    variable-length value through `field(value)`.
+    """
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, field_budget=PROMPT_FIELD_TOKEN_BUDGET):
+        self.budget = budget
+        self.field_budget = field_budget
+
+    def build(self, render, name="prompt"):
+        field_budget = self.field_budget
+        prompt = render(lambda value: format_field(value, field_budget))
+        tokens = estimate_tokens(prompt)
+        while tokens > self.budget and field_budget > MIN_FIELD_TOKEN_BUDGET:
+            field_budget = max(field_budget // 2, MIN_FIELD_TOKEN_BUDGET)
+            prompt = render(lambda value: format_field(value, field_budget))
+            tokens = estimate_tokens(prompt)
+
+        metrics.observe(f"{name}_tokens", tokens)
+        print(f"{name}: ~{tokens} tokens (field budget {field_budget}, total budget {self.budget})")
+        return prompt, {"tokens": tokens, "field_budget": field_budget, "over_budget": tokens > self.budget}
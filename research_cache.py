@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import Column, String, Text, TIMESTAMP
+from sqlalchemy.exc import SQLAlchemyError
+from database import Base, SessionLocal
+from caching import LRUCache
+from info_gather import get_company_and_person_info, get_company_and_person_info_batch
+from structured_output import StructuredOutputError, parse_structured
+import metrics
+
+# Company / decision maker research is the most expensive call in the pipeline
+# (a 900-token Perplexity request), and the same person is researched again for
+# every proposal, reminder and followup. Responses whose research parses are
+# cached in Postgres for RESEARCH_CACHE_TTL_HOURS, with an in-process LRU in front.
+
+RESEARCH_CACHE_TTL_HOURS = float(os.getenv("RESEARCH_CACHE_TTL_HOURS", 72))
+RESEARCH_CACHE_SIZE = int(os.getenv("RESEARCH_CACHE_SIZE", 512))
+
+
+class ResearchCache(Base):
+    __tablename__ = "research_cache"
+    key = Column(String, primary_key=True)
+    company_name = Column(String)
+    person_name = Column(String)
+    position = Column(String)
+    response = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
+
+
+# key -> (expires_at epoch seconds, response)
+_memory_cache = LRUCache(RESEARCH_CACHE_SIZE, name="research_cache_lru")
+_stats_lock = threading.Lock()
+_hits = 0
+_lookups = 0
+
+
+def _normalize(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def research_key(company_name, person_name, position, product_description):
+    """Cache key over the normalized company, person, position and a hash of the product description"""
+    product_hash = hashlib.sha256(_normalize(product_description).encode("utf-8")).hexdigest()
+    parts = [_normalize(company_name), _normalize(person_name), _normalize(position), product_hash]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _record_lookup(source):
+    global _hits, _lookups
+    with _stats_lock:
+        _lookups += 1
+        if source:
+            _hits += 1
+        hit_rate = _hits / _lookups
+    metrics.incr(f"research_cache_{source}_hits" if source else "research_cache_misses")
+    metrics.set_gauge("research_cache_hit_rate", hit_rate)
+
+
+def _is_cacheable(response):
+    """Only cache replies whose research parses, or a bad reply would be served for the whole TTL"""
+    if not isinstance(response, dict) or not response.get("choices"):
+        return False
+    try:
+        parse_structured(response["choices"][0]["message"]["content"], "research")
+        return True
+    except (StructuredOutputError, KeyError, IndexError, TypeError):
+        metrics.incr("research_cache_rejected")
+        return False
+
+
+def get_cached_research(key):
+    """Return the cached research response for `key`, or None when missing or expired"""
+    entry = _memory_cache.get(key)
+    if entry is not None and entry[0] > time.time():
+        return entry[1], "memory"
+
+    db = SessionLocal()
+    try:
+        row = db.query(ResearchCache).filter(ResearchCache.key == key, ResearchCache.expires_at > datetime.utcnow()).first()
+        if row is None:
+            return None, None
+        response = json.loads(row.response)
+        expires_at = (row.expires_at - datetime.utcnow()).total_seconds() + time.time()
+        _memory_cache.set(key, (expires_at, response))
+        return response, "db"
+    except (SQLAlchemyError, RuntimeError, ValueError) as e:
+        print(f"Research cache lookup failed: {e}")
+        return None, None
+    finally:
+        db.close()
+
+
+def store_research(key, company_name, person_name, position, response):
+    ttl = timedelta(hours=RESEARCH_CACHE_TTL_HOURS)
+    _memory_cache.set(key, (time.time() + ttl.total_seconds(), response))
+
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        db.merge(ResearchCache(
+            key=key,
+            company_name=company_name,
+            person_name=person_name,
+            position=position,
+            response=json.dumps(response),
+            created_at=now,
+            expires_at=now + ttl,
+        ))
+        db.commit()
+    except (SQLAlchemyError, RuntimeError) as e:
+        db.rollback()
+        print(f"Research cache store failed: {e}")
+    finally:
+        db.close()
+
+
+def lookup_research(company_name, person_name, position, product_description):
+    """Return the cached research response for these inputs, or None"""
+    if RESEARCH_CACHE_TTL_HOURS <= 0:
+        return None
+    response, source = get_cached_research(research_key(company_name, person_name, position, product_description))
+    _record_lookup(source)
+    if response is not None:
+        print(f"Research cache hit ({source}) for {person_name}")
+    return response
+
+
+def store_research_result(company_name, person_name, position, product_description, research):
+    """Cache research produced elsewhere (e.g. by a single-pass draft) in the chat completion shape"""
+    if RESEARCH_CACHE_TTL_HOURS <= 0 or not research:
+        return
+    response = {"choices": [{"message": {"role": "assistant", "content": json.dumps(research)}}]}
+    key = research_key(company_name, person_name, position, product_description)
+    store_research(key, company_name, person_name, position, response)
+
+
+def get_company_and_person_info_cached(company_name, person_name, position, product_description):
+    """get_company_and_person_info with a TTL cache; only responses with valid research are cached"""
+    response = lookup_research(company_name, person_name, position, product_description)
+    if response is not None:
+        return response
+
+    response = get_company_and_person_info(company_name, person_name, position, product_description)
+    if RESEARCH_CACHE_TTL_HOURS > 0 and _is_cacheable(response):
+        key = research_key(company_name, person_name, position, product_description)
+        store_research(key, company_name, person_name, position, response)
+    return response
+
+
+def get_company_and_person_info_batch_cached(entries, product_description):
+    """Batched get_company_and_person_info_cached: cached entries are served, the rest are researched together"""
+    responses = [lookup_research(entry["company_name"], entry["person_name"], entry["position"], product_description) for entry in entries]
+    missing = [i for i, response in enumerate(responses) if response is None]
+    if missing:
+        fetched = get_company_and_person_info_batch([entries[i] for i in missing], product_description)
+        for i, response in zip(missing, fetched):
+            responses[i] = response
+            entry = entries[i]
+            if RESEARCH_CACHE_TTL_HOURS > 0 and _is_cacheable(response):
+                key = research_key(entry["company_name"], entry["person_name"], entry["position"], product_description)
+                store_research(key, entry["company_name"], entry["person_name"], entry["position"], response)
+    return responses
@@ -0,0 +1,234 @@
+import concurrent.futures
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+import httpx
+import requests
+from caching import LRUCache
+import metrics
+
+# Resilience layer for the external APIs (Perplexity, RapidAPI search, MailTester):
+#   - retries with jittered exponential backoff on 429/5xx and transport errors
+#   - optional hedging: a duplicate request is started once the first one has
+#     taken longer than the service's observed p95 latency
+#   - a circuit breaker per service that fails fast (or serves the last good
+#     response for the same request) while the provider is down
+# Breaker state is exported as the gauge `circuit_breaker_state.<service>`
+# (0 = closed, 1 = half-open, 2 = open).
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 8))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+# Comma separated service names that may send hedged requests, e.g. "search,mailtester"
+HEDGED_SERVICES = {name.strip() for name in os.getenv("HEDGED_SERVICES", "").split(",") if name.strip()}
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+FALLBACK_CACHE_SIZE = int(os.getenv("FALLBACK_CACHE_SIZE", 256))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+
+class ServiceUnavailableError(Exception):
+    """Base class for errors raised when an external service is unavailable"""
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """Raised when a call is rejected because the service's circuit breaker is open"""
+
+
+def _status_code(exc):
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(exc):
+    """True for rate limits, server errors and transport failures (also when wrapped as __cause__)"""
+    while exc is not None:
+        status = _status_code(exc)
+        if status is not None:
+            return status in RETRYABLE_STATUS_CODES
+        if isinstance(exc, (httpx.TransportError, requests.ConnectionError, requests.Timeout)):
+            return True
+        exc = exc.__cause__
+    return False
+
+
+def _retry_after(exc):
+    """Seconds requested by a Retry-After header, if any"""
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        if response is not None:
+            try:
+                return float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                return None
+        exc = exc.__cause__
+    return None
+
+
+def backoff_delay(attempt, exc=None):
+    """Full-jitter exponential backoff, honouring Retry-After when the server sends one"""
+    retry_after = _retry_after(exc)
+    if retry_after is not None:
+        return min(RETRY_MAX_DELAY, retry_after)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; one trial call is let through after `reset_timeout`"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        metrics.set_gauge(f"circuit_breaker_state.{name}", _STATE_GAUGE[CLOSED])
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            self.state = state
+            metrics.set_gauge(f"circuit_breaker_state.{self.name}", _STATE_GAUGE[state])
+            if state == OPEN:
+                metrics.incr(f"circuit_breaker_opened.{self.name}")
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                return True
+            return self.state == CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class ResilientService:
+    """Retry, hedging and circuit-breaker policy for one external service"""
+
+    def __init__(self, name, max_attempts=RETRY_MAX_ATTEMPTS, hedge=None):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = name in HEDGED_SERVICES if hedge is None else hedge
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyTracker()
+        self._fallback = LRUCache(FALLBACK_CACHE_SIZE, name=f"{name}_fallback")
+
+    def _hedge_delay(self):
+        return self.latency.percentile(HEDGE_PERCENTILE) if self.hedge else None
+
+    def _fail_fast(self, cache_key):
+        metrics.incr(f"{self.name}_rejected")
+        if cache_key is not None:
+            cached = self._fallback.get(cache_key)
+            if cached is not None:
+                print(f"{self.name} circuit open, serving cached response")
+                return cached
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def _succeeded(self, result, started, cache_key):
+        self.latency.record(time.perf_counter() - started)
+        self.breaker.record_success()
+        if cache_key is not None:
+            self._fallback.set(cache_key, result)
+        return result
+
+    def _attempt(self, fn, args, kwargs):
+        delay = self._hedge_delay()
+        if delay is None:
+            return fn(*args, **kwargs)
+
+        # Run in copies of the caller's context so usage tags follow the request
+        primary = _hedge_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        metrics.incr(f"{self.name}_hedged")
+        hedge = _hedge_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, fn, *args, cache_key=None, **kwargs):
+        """Call fn(*args, **kwargs) under this service's policy"""
+        if not self.breaker.allow():
+            return self._fail_fast(cache_key)
+
+        for attempt in range(self.max_attempts):
+            started = time.perf_counter()
+            try:
+                result = self._attempt(fn, args, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The service answered; the request itself was bad
+                    self.breaker.record_success()
+                    raise
+                if attempt + 1 >= self.max_attempts:
+                    self.breaker.record_failure()
+                    raise
+                delay = backoff_delay(attempt, e)
+                metrics.incr(f"{self.name}_retries")
+                print(f"{self.name} call failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            return self._succeeded(result, started, cache_key)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(name):
+    """Return the shared ResilientService for `name`"""
+    with _services_lock:
+        if name not in _services:
+            _services[name] = ResilientService(name)
+        return _services[name]
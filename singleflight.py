@@ -0,0 +1,61 @@
+import hashlib
+import json
+import threading
+import metrics
+
+
+def request_key(*parts):
+    """Stable hash of JSON-serialisable request parts, for use as a SingleFlight key"""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function; callers that arrive while it
+    is still in flight wait for it and receive the same result (or exception).
+    Nothing is cached once the call completes.
+
+    When `name` is given, coalesced callers are counted as `<name>_coalesced`.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _record_coalesced(self):
+        if self.name:
+            metrics.incr(f"{self.name}_coalesced")
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._record_coalesced()
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+import dns.exception
+import dns.message
+import dns.rdatatype
+import dns.rrset
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Local stand-ins for every external service the pipeline calls, for offline
+# runs and load tests without spending API credit:
+#   python standins.py [--llm-latency 1.5] [--responses canned.json]
+#
+# One HTTP server (default port 8900) serves:
+#   /chat/completions      OpenAI-style chat endpoint (Perplexity), streaming included
+#   /search                RapidAPI DuckDuckGo search
+#   /mailtester/token      MailTester token
+#   /mailtester/ninja      MailTester verification (--deliverable-rate of domains accept mail)
+# plus a UDP DNS stub that answers every MX query (default port 8953) and an
+# aiosmtpd sink that accepts and counts all mail (default port 8925).
+#
+# Chat replies are canned JSON picked by recognising which pipeline prompt was
+# sent (see _reply_kind). --responses takes a JSON file mapping a kind to the
+# reply content to use instead. The environment for the app is printed on start.
+
+REPLY_KINDS = ("company_list", "dm_map", "research", "research_batch", "draft", "single_pass")
+FIRST_NAMES = ["Jordan", "Priya", "Marcus", "Elena", "Kenji", "Amara", "Lucas", "Sofia"]
+LAST_NAMES = ["Lee", "Raman", "Okafor", "Novak", "Tanaka", "Silva", "Berg", "Haddad"]
+INDUSTRIES = ["Logistics", "Fintech", "Healthcare", "Retail", "Manufacturing", "SaaS"]
+
+stats = {"chat": 0, "search": 0, "mailtester": 0, "dns": 0, "smtp": 0}
+
+
+def research_reply(company="the company"):
+    return {
+        "company_analysis": {
+            "recent_news": f"{company} announced an expansion into two new regions last quarter.",
+            "financial_health": "Revenue up 12% year over year with stable margins.",
+            "verified_challenges": ["Manual sales prospecting", "Long sales cycles"],
+            "strategic_priorities": ["Automate outbound", "Grow mid-market share"],
+        },
+        "decision_maker_profile": {
+            "communication_style": "data-driven",
+            "personality_indicators": "Direct, metrics focused, values brevity",
+            "personality_type": "ENTJ (Extraverted, Intuitive, Thinking, Judging)",
+            "key_achievements": "Doubled pipeline coverage in 18 months",
+            "recent_activities": "Spoke at a regional sales leadership summit",
+        },
+        "synergy_points": {
+            "product_fit": "Automates prospect research and first-touch drafting",
+            "persuasion_levers": ["Time saved per rep", "Pipeline growth", "Fast rollout"],
+            "urgency_factors": ["Quarter-end targets"],
+        },
+    }
+
+
+def draft_reply(company="the company"):
+    return {
+        "subject": f"Cutting prospecting time at {company}",
+        "body": f"Hi,\n\nTeams like yours at {company} spend hours researching every lead. We automate that.\n\nWorth a 15 minute call next week?",
+    }
+
+
+def _reply_kind(text):
+    """Which pipeline prompt a chat request came from"""
+    if '"results": [{"id"' in text:
+        return "research_batch"
+    if '"research": ' in text and '"email"' in text:
+        return "single_pass"
+    if "'subject' and 'body'" in text:
+        return "draft"
+    if "Identify Decision Makers" in text:
+        return "dm_map"
+    if "Ideal Client Profile" in text:
+        return "company_list"
+    return "research"
+
+
+def _generate(kind, text):
+    """Canned reply content for a prompt of the given kind"""
+    if kind == "company_list":
+        limit = re.search(r"The top (\d+) companies", text)
+        companies = []
+        for _ in range(int(limit.group(1)) if limit else 5):
+            name = f"Standin {uuid.uuid4().hex[:8]}"
+            companies.append({"name": name, "industry": random.choice(INDUSTRIES), "domain": name.lower().replace(' ', '') + ".example"})
+        return json.dumps(companies)
+    if kind == "dm_map":
+        domain = re.search(r"Initial Domain Claim: (\S+)", text)
+        person = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+        return json.dumps({person: "CEO", "domain": domain.group(1) if domain else "standin.example"})
+    if kind == "research_batch":
+        targets = re.findall(r"\[(\d+)\] Company: ([^|\n]+)", text)
+        return json.dumps({"results": [{"id": int(i), "research": research_reply(company.strip())} for i, company in targets]})
+    company = re.search(r"Company: ([^\n|]+)", text)
+    company = company.group(1).strip() if company else "the company"
+    if kind == "draft":
+        return json.dumps(draft_reply(company))
+    if kind == "single_pass":
+        return json.dumps({"research": research_reply(company), "email": draft_reply(company)})
+    return json.dumps(research_reply(company))
+
+
+def create_app(llm_latency=1.0, llm_jitter=0.5, search_latency=0.3, responses=None, deliverable_rate=1.0):
+    app = FastAPI()
+    responses = responses or {}
+
+    async def _latency(mean, jitter):
+        await asyncio.sleep(max(0.0, mean + random.uniform(-jitter, jitter)))
+
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        stats["chat"] += 1
+        text = "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+        kind = _reply_kind(text)
+        content = responses.get(kind)
+        if content is None:
+            content = _generate(kind, text)
+        elif not isinstance(content, str):
+            content = json.dumps(content)
+        usage = {"prompt_tokens": len(text) // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = payload.get("model", "sonar")
+        await _latency(llm_latency, llm_jitter)
+
+        if payload.get("stream"):
+            async def events():
+                for i in range(0, len(content), 40):
+                    chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": content[i:i + 40]}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(0.01)
+                done = {"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return {
+            "id": str(uuid.uuid4()),
+            "model": model,
+            "created": int(time.time()),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    @app.get("/search")
+    async def search(q: str):
+        stats["search"] += 1
+        await _latency(search_latency, search_latency / 2)
+        people = [f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}" for _ in range(3)]
+        return {"results": [
+            {"title": f"{person} - LinkedIn", "url": f"https://linkedin.com/in/{person.lower().replace(' ', '-')}", "description": f"{person} | {q}"}
+            for person in people
+        ]}
+
+    @app.get("/mailtester/token")
+    async def mailtester_token(key: str = ""):
+        return {"token": "standin-token"}
+
+    @app.get("/mailtester/ninja")
+    async def mailtester_verify(email: str, token: str = ""):
+        stats["mailtester"] += 1
+        await _latency(search_latency, search_latency / 2)
+        # Decided per domain, so every address at a company gets the same answer
+        if random.Random(email.split("@")[-1]).random() < deliverable_rate:
+            return {"email": email, "code": "ok", "message": "Accepted"}
+        return {"email": email, "code": "ko", "message": "Rejected"}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+class DNSStub(asyncio.DatagramProtocol):
+    """Answers every MX query with one exchange; other queries get an empty answer"""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            query = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return
+        stats["dns"] += 1
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        if question.rdtype == dns.rdatatype.MX:
+            response.answer.append(dns.rrset.from_text(question.name, 300, "IN", "MX", f"10 {self.exchange}."))
+        self.transport.sendto(response.to_wire(), addr)
+
+
+def start_smtp_sink(host, port):
+    """Start an aiosmtpd server that accepts any login and discards mail; returns the controller or None"""
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+    except ImportError:
+        print("aiosmtpd is not installed (pip install aiosmtpd); SMTP sink not started")
+        return None
+
+    class Sink:
+        async def handle_DATA(self, server, session, envelope):
+            stats["smtp"] += 1
+            return "250 Message accepted"
+
+    controller = Controller(
+        Sink(), hostname=host, port=port,
+        auth_require_tls=False, authenticator=lambda *args: AuthResult(success=True),
+    )
+    controller.start()
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for the LLM, search, MailTester, DNS and SMTP services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dns-port", type=int, default=8953)
+    parser.add_argument("--smtp-port", type=int, default=8925)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mean seconds per chat completion")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="uniform +/- seconds around the mean")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="mean seconds per search / MailTester call")
+    parser.add_argument("--deliverable-rate", type=float, default=1.0, help="fraction of company domains whose addresses verify")
+    parser.add_argument("--responses", help="JSON file mapping reply kind (%s) to canned content" % ", ".join(REPLY_KINDS))
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+
+    base = f"http://{args.host}:{args.port}"
+    print("Point the app at the stand-ins with:")
+    print(f"  PERPLEXITY_BASE_URL={base}")
+    print(f"  SEARCH_API_URL={base}/search")
+    print(f"  MAILTESTER_API_URL={base}/mailtester/ninja")
+    print(f"  MAILTESTER_TOKEN_URL={base}/mailtester/token?key=yourkey")
+    print(f"  DNS_NAMESERVER={args.host}:{args.dns_port}")
+    print(f"  SMTP_OVERRIDE={args.host}:{args.smtp_port}")
+    print("  PERPLEXITY_API_KEY, GOOGLE_API_KEY and MAILTESTER_API_KEY can be any non-empty value")
+
+    smtp = start_smtp_sink(args.host, args.smtp_port)
+    app = create_app(args.llm_latency, args.llm_jitter, args.search_latency, responses, args.deliverable_rate)
+
+    @app.on_event("startup")
+    async def start_dns():
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: DNSStub("mx.standin.example"), local_addr=(args.host, args.dns_port))
+
+    try:
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    finally:
+        if smtp:
+            smtp.stop()
+
+
+if __name__ == "__main__":
+    main()
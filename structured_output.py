@@ -0,0 +1,317 @@
+import json
+import re
+import metrics
+
+# Structured output extraction for LLM replies.
+#
+# parse_json() pulls the first JSON value out of a reply in a single pass. It
+# skips prose, ```json fences and <think> reasoning blocks, and repairs the
+# failure modes seen in practice while it copies:
+#   - // and /* */ comments and trailing commas are dropped
+#   - raw control characters and stray quotes inside strings are escaped
+#   - Python literals (True/False/None) become JSON literals
+#   - a truncated reply is closed off at the last complete member; a string
+#     value cut off mid-way is dropped with its member, never closed and kept
+#     (a half-written email body must not pass as a draft)
+# parse_structured() then validates and normalizes the value for a known
+# response type (see SCHEMAS).
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a reply holds no usable JSON for the requested response type"""
+
+
+_CLOSERS = {'{': '}', '[': ']'}
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+_THINK_END = "</think>"
+_FENCE = re.compile(r"```(?:json)?\s*")
+# How many earlier member boundaries to try when a truncated reply will not close cleanly
+_MAX_CUTBACKS = 8
+_decoder = json.JSONDecoder()
+# Runs of characters that are copied unchanged, inside and outside strings
+_STRING_RUN = re.compile(r'[^"\\\x00-\x1f]+')
+_PLAIN_RUN = re.compile(r'[^"{}\[\],/`A-Za-z]+')
+
+
+def _strip_trailing_comma(out):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def _close(out, stack):
+    out = list(out)
+    for closer in reversed(stack):
+        _strip_trailing_comma(out)
+        out.append(closer)
+    return ''.join(out)
+
+
+def _string_ends_at(text, i):
+    """Whether the quote at text[i] closes the string (the next significant character is a delimiter or a comment)"""
+    j = i + 1
+    while j < len(text) and text[j] in ' \t\r\n':
+        j += 1
+    return j >= len(text) or text[j] in ',:}]`' or text.startswith(('//', '/*'), j)
+
+
+def _scan(text, start):
+    """Copy the JSON value starting at text[start], repairing as it goes.
+
+    Returns (candidates, repaired). candidates is a list of JSON strings to try
+    in order: the complete value, or for a truncated reply the value closed at
+    its end (unless it ends inside a string) and then at each earlier member
+    boundary.
+    """
+    out = []
+    stack = []
+    boundaries = []  # (len(out), stack) at each comma outside strings
+    in_string = False
+    escape = False
+    repaired = False
+    i, n = start, len(text)
+    while i < n:
+        c = text[i]
+        if in_string:
+            run = None if escape else _STRING_RUN.match(text, i)
+            if run:
+                out.append(run.group())
+                i = run.end()
+                continue
+            if escape:
+                escape = False
+                out.append(c)
+            elif c == '\\':
+                escape = True
+                out.append(c)
+            elif c == '"':
+                if _string_ends_at(text, i):
+                    in_string = False
+                    out.append(c)
+                else:
+                    out.append('\\"')
+                    repaired = True
+            elif c < ' ':
+                out.append(_CONTROL_ESCAPES.get(c, '\\u%04x' % ord(c)))
+                repaired = True
+            else:
+                out.append(c)
+            i += 1
+            continue
+
+        if c == '"':
+            in_string = True
+            out.append(c)
+        elif c in _CLOSERS:
+            stack.append(_CLOSERS[c])
+            out.append(c)
+        elif c in '}]':
+            if not stack:
+                break
+            _strip_trailing_comma(out)
+            closer = stack.pop()
+            if c != closer:
+                repaired = True
+            out.append(closer)
+            if not stack:
+                return [''.join(out)], repaired
+        elif c == ',':
+            boundaries.append((len(out), tuple(stack)))
+            out.append(c)
+        elif c == '/' and text.startswith('//', i):
+            newline = text.find('\n', i)
+            i = n if newline == -1 else newline
+            repaired = True
+            continue
+        elif c == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            repaired = True
+            continue
+        elif c == '`':
+            # Closing code fence before the value was closed: the reply was cut short
+            break
+        elif c.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == '_'):
+                j += 1
+            word = text[i:j]
+            if word in _LITERALS:
+                word = _LITERALS[word]
+                repaired = True
+            out.append(word)
+            i = j
+            continue
+        else:
+            run = _PLAIN_RUN.match(text, i)
+            if run:
+                out.append(run.group())
+                i = run.end()
+                continue
+            out.append(c)
+        i += 1
+
+    # Truncated: close what we have, then fall back to earlier member boundaries.
+    # A cut-off string is incomplete content, so only the boundaries before it are tried
+    candidates = [] if in_string else [_close(out, stack)]
+    for length, boundary_stack in reversed(boundaries[-_MAX_CUTBACKS:]):
+        candidates.append(_close(out[:length], boundary_stack))
+    return candidates, True
+
+
+def _value_start(text, starts):
+    """Index where the JSON value begins: inside a code fence if there is one, else the first opener"""
+    fence = _FENCE.search(text)
+    if fence:
+        inside = [text.find(opener, fence.end()) for opener in starts]
+        inside = [i for i in inside if i != -1]
+        if inside:
+            return min(inside)
+    found = [text.find(opener) for opener in starts]
+    found = [i for i in found if i != -1]
+    return min(found) if found else -1
+
+
+def parse_json(text, starts='{['):
+    """Extract the first JSON value from an LLM reply; returns (value, repaired)"""
+    if not isinstance(text, str):
+        raise StructuredOutputError("reply content is not text")
+    think_end = text.rfind(_THINK_END)
+    if think_end != -1:
+        text = text[think_end + len(_THINK_END):]
+    text = text.strip()
+
+    if text[:1] in starts:
+        try:
+            return json.loads(text), False
+        except ValueError:
+            pass
+
+    start = _value_start(text, starts)
+    if start == -1:
+        raise StructuredOutputError("no JSON value found in reply")
+    try:
+        # Well-formed JSON wrapped in prose, fences or citations needs no repair
+        return _decoder.raw_decode(text, start)[0], False
+    except ValueError:
+        pass
+    candidates, repaired = _scan(text, start)
+    for candidate in candidates:
+        try:
+            return json.loads(candidate), repaired
+        except ValueError:
+            continue
+    raise StructuredOutputError("reply JSON could not be repaired")
+
+
+# Schema validators: take the parsed value, return the normalized value or raise StructuredOutputError
+
+def _require_dict(value, kind):
+    if not isinstance(value, dict):
+        raise StructuredOutputError(f"{kind}: expected a JSON object, got {type(value).__name__}")
+    return value
+
+
+def _clean_domain(domain):
+    domain = domain.strip().lower()
+    domain = re.sub(r'^(https?://)?(www\.)?', '', domain)
+    return domain.split('/')[0]
+
+
+def validate_company_list(value):
+    """List of {"name", "industry", "domain"}; entries without a name or domain are dropped"""
+    if isinstance(value, dict):
+        # {"companies": [...]} or a similar single-key wrapper
+        value = next((item for item in value.values() if isinstance(item, list)), [value])
+    if not isinstance(value, list):
+        raise StructuredOutputError("company_list: expected a list of companies")
+    companies = []
+    for item in value:
+        if not isinstance(item, dict):
+            continue
+        name, domain = item.get('name'), item.get('domain')
+        if not isinstance(name, str) or not isinstance(domain, str) or not name.strip() or not domain.strip():
+            continue
+        companies.append(dict(item, name=name.strip(), domain=_clean_domain(domain), industry=item.get('industry') or ''))
+    if not companies:
+        raise StructuredOutputError("company_list: no company with a name and domain")
+    return companies
+
+
+def validate_dm_map(value):
+    """{"<person name>": "<role>", ..., "domain": "<domain>"}"""
+    value = _require_dict(value, "dm_map")
+    if not isinstance(value.get('domain'), str) or not value['domain'].strip():
+        raise StructuredOutputError("dm_map: missing domain")
+    people = {key: role for key, role in value.items() if key != 'domain' and isinstance(role, str)}
+    if not people:
+        raise StructuredOutputError("dm_map: no decision maker")
+    return dict(people, domain=_clean_domain(value['domain']))
+
+
+def validate_research(value):
+    """Research JSON; missing sections become empty objects"""
+    value = _require_dict(value, "research")
+    sections = ('company_analysis', 'decision_maker_profile', 'synergy_points')
+    if not any(isinstance(value.get(section), dict) for section in sections):
+        raise StructuredOutputError("research: none of the expected sections present")
+    return dict(value, **{section: value.get(section) if isinstance(value.get(section), dict) else {} for section in sections})
+
+
+def validate_draft(value):
+    """{"subject", "body"} (also accepted nested under "email")"""
+    value = _require_dict(value, "draft")
+    if isinstance(value.get('email'), dict):
+        value = value['email']
+    subject, body = value.get('subject'), value.get('body')
+    if not isinstance(subject, str) or not isinstance(body, str) or not body.strip():
+        raise StructuredOutputError("draft: missing subject or body")
+    return dict(value, subject=subject.strip(), body=body)
+
+
+def validate_single_pass(value):
+    """{"research": {...}, "email": {"subject", "body"}}"""
+    value = _require_dict(value, "single_pass")
+    return {"research": validate_research(value.get('research')), "email": validate_draft(value.get('email'))}
+
+
+def validate_research_batch(value):
+    """{"results": [{"id", "research"}]} -> {id: research}; invalid entries are dropped"""
+    if isinstance(value, dict):
+        value = value.get('results', [])
+    if not isinstance(value, list):
+        raise StructuredOutputError("research_batch: expected a list of results")
+    results = {}
+    for item in value:
+        try:
+            results[int(item['id'])] = validate_research(item['research'])
+        except (TypeError, KeyError, ValueError):
+            continue
+    return results
+
+
+SCHEMAS = {
+    "company_list": (validate_company_list, '{['),
+    "dm_map": (validate_dm_map, '{'),
+    "research": (validate_research, '{'),
+    "draft": (validate_draft, '{'),
+    "single_pass": (validate_single_pass, '{'),
+    "research_batch": (validate_research_batch, '{['),
+}
+
+
+def parse_structured(text, schema=None):
+    """Parse an LLM reply and validate it against `schema` (a SCHEMAS key); raises StructuredOutputError"""
+    name = schema or "json"
+    validate, starts = SCHEMAS[schema] if schema else (None, '{[')
+    try:
+        value, repaired = parse_json(text, starts)
+        if validate is not None:
+            value = validate(value)
+    except StructuredOutputError:
+        metrics.incr(f"structured_output_failed.{name}")
+        raise
+    metrics.incr(f"structured_output_{'repaired' if repaired else 'parsed'}.{name}")
+    return value
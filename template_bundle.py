@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import faiss
+
+# Compiled template bundle: parsed templates, their embeddings and the FAISS
+# index, written once and memory-mapped at startup so the PDFs do not have to
+# be parsed and re-embedded on every boot.
+#
+# Layout: <TEMPLATE_BUNDLE_DIR>/v<BUNDLE_VERSION>-<key>/
+#   manifest.json   - bundle version, key, model, dtype and source file hashes
+#   templates.json  - {category: [{"title": str, "content": str}]}
+#   embeddings.npy  - (n_templates, dim) matrix in template order
+#   indexes/<category>.faiss - serialized IndexIDMap2 per template category, keyed by template id
+
+BUNDLE_VERSION = 3
+TEMPLATE_BUNDLE_DIR = os.getenv("TEMPLATE_BUNDLE_DIR", "template_bundle")
+TEMPLATE_BUNDLE_DTYPE = os.getenv("TEMPLATE_BUNDLE_DTYPE", "float32")
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_bundle_key(pdf_paths, model_name):
+    """Content hash of the template PDFs (plus model and bundle version)"""
+    digest = hashlib.sha256()
+    digest.update(f"v{BUNDLE_VERSION}:{model_name}".encode('utf-8'))
+    for category in sorted(pdf_paths):
+        digest.update(f"|{category}:{_file_sha256(pdf_paths[category])}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def bundle_path(key, bundle_dir=None):
+    return os.path.join(bundle_dir or TEMPLATE_BUNDLE_DIR, f"v{BUNDLE_VERSION}-{key[:16]}")
+
+
+def _read_index(path):
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        # Not every index type supports memory-mapping; fall back to a plain read.
+        return faiss.read_index(path)
+
+
+def load_bundle(pdf_paths, model_name, bundle_dir=None):
+    """Load the bundle matching the current PDFs, or return None if there is none"""
+    try:
+        key = compute_bundle_key(pdf_paths, model_name)
+    except OSError as e:
+        print(f"Unable to hash template PDFs: {e}")
+        return None
+
+    path = bundle_path(key, bundle_dir)
+    try:
+        with open(os.path.join(path, "manifest.json")) as file:
+            manifest = json.load(file)
+        if manifest.get("key") != key or manifest.get("version") != BUNDLE_VERSION:
+            return None
+        with open(os.path.join(path, "templates.json")) as file:
+            templates = json.load(file)
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        indexes = {
+            category: _read_index(os.path.join(path, "indexes", f"{category}.faiss"))
+            for category in manifest.get("categories", [])
+        }
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Template bundle at {path} not usable: {e}")
+        return None
+
+    print(f"Loaded template bundle {path}")
+    return {"templates": templates, "embeddings": embeddings, "indexes": indexes, "manifest": manifest}
+
+
+def write_bundle(pdf_paths, model_name, templates, embeddings, indexes, bundle_dir=None):
+    """Write a bundle for the current PDFs and return its directory"""
+    key = compute_bundle_key(pdf_paths, model_name)
+    path = bundle_path(key, bundle_dir)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "key": key,
+        "model": model_name,
+        "dtype": TEMPLATE_BUNDLE_DTYPE,
+        "categories": sorted(indexes),
+        "sources": {category: _file_sha256(pdf_path) for category, pdf_path in pdf_paths.items()},
+    }
+    stripped = {
+        category: [{"title": t["title"], "content": t["content"]} for t in category_templates]
+        for category, category_templates in templates.items()
+    }
+
+    # Build in a temporary directory and rename it into place so that a
+    # concurrently starting worker never sees a partially written bundle.
+    tmp_path = tempfile.mkdtemp(dir=parent)
+    try:
+        with open(os.path.join(tmp_path, "templates.json"), 'w') as file:
+            json.dump(stripped, file)
+        np.save(os.path.join(tmp_path, "embeddings.npy"), np.asarray(embeddings, dtype=TEMPLATE_BUNDLE_DTYPE))
+        os.makedirs(os.path.join(tmp_path, "indexes"))
+        for category, index in indexes.items():
+            faiss.write_index(index, os.path.join(tmp_path, "indexes", f"{category}.faiss"))
+        with open(os.path.join(tmp_path, "manifest.json"), 'w') as file:
+            json.dump(manifest, file)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    print(f"Wrote template bundle {path}")
+    return path
+
+
+if __name__ == "__main__":
+    # Build step: python template_bundle.py
+    from config import TEMPLATE_PDF_PATHS
+    from email_proposal import build_template_bundle
+
+    build_template_bundle(TEMPLATE_PDF_PATHS)
@@ -0,0 +1,179 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import Column, String, Integer, Float, TIMESTAMP, func
+from sqlalchemy.exc import SQLAlchemyError
+from database import Base, SessionLocal
+import metrics
+
+# Token, cost and latency accounting for LLM calls.
+#
+# llm_client records every completed call here. Records are tagged with the
+# user_id / product_id / stage set by the surrounding usage_context() and are
+# written to the llm_usage table in batches (every USAGE_FLUSH_SIZE records or
+# USAGE_FLUSH_INTERVAL seconds, and on shutdown).
+
+USAGE_FLUSH_SIZE = int(os.getenv("USAGE_FLUSH_SIZE", 50))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 10))
+# Records kept in memory while the database is unreachable
+USAGE_MAX_BUFFER = int(os.getenv("USAGE_MAX_BUFFER", 5000))
+
+# USD per token: (input, output)
+MODEL_PRICING = {
+    "sonar": (0.0000002, 0.0000002),
+    "sonar-reasoning-pro": (0.000005, 0.000008),
+}
+
+
+class LLMUsage(Base):
+    __tablename__ = "llm_usage"
+    id = Column(String, primary_key=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow, index=True)
+    user_id = Column(String, index=True)
+    product_id = Column(String, index=True)
+    stage = Column(String)
+    model = Column(String)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float)
+    cost = Column(Float, default=0.0)
+
+
+_tags = contextvars.ContextVar("usage_tags", default={})
+_buffer = []
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher_lock = threading.Lock()
+_flusher = None
+
+
+@contextmanager
+def usage_context(**tags):
+    """Tag LLM calls made inside the block (user_id, product_id, stage); nested blocks add to or override outer tags"""
+    token = _tags.set({**_tags.get(), **{key: value for key, value in tags.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def tag_usage(**tags):
+    """Tag LLM calls for the rest of the current context (e.g. a whole request handler or job)"""
+    _tags.set({**_tags.get(), **{key: value for key, value in tags.items() if value is not None}})
+
+
+def current_tags():
+    return dict(_tags.get())
+
+
+def compute_cost(model, prompt_tokens, completion_tokens):
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return prompt_tokens * input_price + completion_tokens * output_price
+
+
+def record(model, usage, latency_seconds):
+    """Record one LLM call from its `usage` block; returns the stored record"""
+    usage = usage or {}
+    tags = _tags.get()
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    entry = {
+        "id": str(uuid.uuid4()),
+        "created_at": datetime.utcnow(),
+        "user_id": tags.get("user_id"),
+        "product_id": tags.get("product_id"),
+        "stage": tags.get("stage", "unknown"),
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": int(usage.get("total_tokens") or prompt_tokens + completion_tokens),
+        "latency_ms": latency_seconds * 1000,
+        "cost": compute_cost(model, prompt_tokens, completion_tokens),
+    }
+    metrics.incr(f"llm_tokens.{entry['stage']}", entry["total_tokens"])
+    metrics.incr(f"llm_cost_usd.{entry['stage']}", entry["cost"])
+    metrics.observe(f"llm_stage_seconds.{entry['stage']}", latency_seconds)
+
+    with _buffer_lock:
+        _buffer.append(entry)
+        if len(_buffer) > USAGE_MAX_BUFFER:
+            del _buffer[:len(_buffer) - USAGE_MAX_BUFFER]
+        full = len(_buffer) >= USAGE_FLUSH_SIZE
+    _ensure_flusher()
+    if full:
+        flush()
+    return entry
+
+
+def flush():
+    """Write buffered records to the llm_usage table"""
+    with _flush_lock:
+        with _buffer_lock:
+            batch = _buffer[:]
+            del _buffer[:]
+        if not batch:
+            return 0
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(LLMUsage, batch)
+            db.commit()
+            return len(batch)
+        except (SQLAlchemyError, RuntimeError) as e:
+            db.rollback()
+            print(f"Usage flush failed, keeping {len(batch)} records: {e}")
+            with _buffer_lock:
+                _buffer[:0] = batch[-USAGE_MAX_BUFFER:]
+            return 0
+        finally:
+            db.close()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        flush()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None and USAGE_FLUSH_INTERVAL > 0:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically, name="usage-flusher", daemon=True)
+                _flusher.start()
+
+
+def _rows(query, keys):
+    return [dict(zip(keys, row)) for row in query.all()]
+
+
+def aggregate(db, user_id, product_id=None, days=30):
+    """Per-product, per-day and per-stage totals of calls, tokens, cost and latency for a user"""
+    since = datetime.utcnow() - timedelta(days=days)
+    filters = [LLMUsage.user_id == user_id, LLMUsage.created_at >= since]
+    if product_id:
+        filters.append(LLMUsage.product_id == product_id)
+    totals = [
+        func.count(LLMUsage.id),
+        func.coalesce(func.sum(LLMUsage.prompt_tokens), 0),
+        func.coalesce(func.sum(LLMUsage.completion_tokens), 0),
+        func.coalesce(func.sum(LLMUsage.cost), 0.0),
+        func.avg(LLMUsage.latency_ms),
+    ]
+    total_keys = ["calls", "prompt_tokens", "completion_tokens", "cost", "avg_latency_ms"]
+    day = func.date(LLMUsage.created_at)
+
+    by_product = db.query(LLMUsage.product_id, *totals).filter(*filters).group_by(LLMUsage.product_id)
+    by_day = db.query(day, LLMUsage.product_id, *totals).filter(*filters).group_by(day, LLMUsage.product_id).order_by(day)
+    by_stage = db.query(LLMUsage.stage, *totals).filter(*filters).group_by(LLMUsage.stage)
+    return {
+        "since": since.isoformat(),
+        "by_product": _rows(by_product, ["product_id"] + total_keys),
+        "by_day": [dict(row, date=str(row["date"])) for row in _rows(by_day, ["date", "product_id"] + total_keys)],
+        "by_stage": _rows(by_stage, ["stage"] + total_keys),
+    }